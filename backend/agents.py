@@ -1,15 +1,28 @@
 import os
 import json
 import uuid
-from typing import List, Dict, Any, Optional
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Optional, Tuple
 from datetime import datetime, timedelta
 
 from google.adk.agents import LlmAgent
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.models import Gemini
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.genai import types
 from dotenv import load_dotenv
-from PyPDF2 import PdfReader
+from pydantic import BaseModel, ValidationError
+
+from pdf_cache import PROCESS_CONTEXT, get_page_count, get_pages, mark_pool_worker, shutdown_parallel_pool
+from rate_limiter import RateLimiter, estimate_tokens
+from llm_cache import ResponseCache, SingleFlight, cache_key
+from retry import RetryPolicy
+from scheduler import default_notes, schedule_locally, split_hour_budget
+from json_stream import ArrayItemStream, recover_json
+from schemas import (SyllabusResult, ExamScopeResult, TocResult, StudyGuideResult,
+                     StudyPlanResult, NotesResult)
 
 ENV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".env.local"))
 load_dotenv(dotenv_path=ENV_PATH)
@@ -21,36 +34,61 @@ if os.getenv("GEMINI_API_KEY") and not os.getenv("GOOGLE_API_KEY"):
 MODEL_NAME = "gemini-2.5-flash"
 APP_NAME = "prep_x_study_planner"
 
-# Rate limiter — free tier is 5 RPM, need 13s between calls
-import asyncio
-import time
-_last_api_call = 0.0
-_RPM_DELAY = 13  # seconds between API calls (5 RPM = 12s min, 13s for safety)
-
-async def _rate_limit():
-    """Wait if needed to stay under the Gemini free-tier RPM limit."""
-    global _last_api_call
-    now = time.time()
-    elapsed = now - _last_api_call
-    if elapsed < _RPM_DELAY:
-        wait = _RPM_DELAY - elapsed
-        print(f"  [Rate limiter] Waiting {wait:.1f}s to stay under RPM limit...")
-        await asyncio.sleep(wait)
-    _last_api_call = time.time()
+# Shared by every agent: Gemini caches its genai client, so all calls reuse the
+# same HTTP connection pool instead of a new client (and TLS handshake) per call.
+gemini_model = Gemini(model=MODEL_NAME)
+
+# Rate limiter — defaults match the Gemini free tier (5 RPM, 250K TPM, no burst).
+# On a paid key, raise GEMINI_RPM / GEMINI_TPM / GEMINI_BURST in .env.local.
+# The limiter lives in this process, so with several uvicorn workers the key's
+# quota is split evenly between them: WEB_CONCURRENCY (which uvicorn also uses
+# as its default --workers) says how many there are.
+GEMINI_WORKERS = max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+gemini_limiter = RateLimiter(
+    rpm=float(os.getenv("GEMINI_RPM", "5")) / GEMINI_WORKERS,
+    tpm=float(os.getenv("GEMINI_TPM", "250000")) / GEMINI_WORKERS,
+    burst=float(os.getenv("GEMINI_BURST", "1")) / GEMINI_WORKERS,
+)
+
+# Response cache — identical (agent, model, instruction, message) calls are
+# served from SQLite instead of Gemini. LLM_CACHE=0 disables it.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+llm_cache = ResponseCache(
+    path=os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache.sqlite3")),
+    ttl_seconds=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+    max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024),
+)
+
+# Identical calls already in flight (e.g. two sessions analyzing the same
+# syllabus) share one Gemini request instead of each taking a rate-limit slot.
+inflight_calls = SingleFlight()
 
+# Transient 429/5xx errors are retried with backoff instead of failing the plan
+retry_policy = RetryPolicy(
+    max_attempts=int(os.getenv("LLM_RETRY_ATTEMPTS", "5")),
+    base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "2")),
+    max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "60")),
+    deadline=float(os.getenv("LLM_CALL_DEADLINE", "300")),
+)
 
 # ---------------------------------------------------------------------------
 # PDF utilities — extract text locally to avoid sending full PDFs to Gemini
+# (per-page text is cached on disk by content hash, see pdf_cache.py)
 # ---------------------------------------------------------------------------
 
-def extract_pdf_text(path: str, start_page: int = 0, end_page: Optional[int] = None) -> str:
-    """Extract text from a PDF file for a given page range (0-indexed)."""
-    reader = PdfReader(path)
-    total = len(reader.pages)
+def extract_pdf_text(path: str, start_page: int = 0, end_page: Optional[int] = None,
+                     parallel: Optional[bool] = None) -> str:
+    """Extract text from a PDF file for a given page range (0-indexed).
+
+    Large uncached ranges are split into chunks and extracted across a process
+    pool; parallel=True/False forces the mode either way.
+    """
+    total = get_page_count(path)
     end = min(end_page or total, total)
+    pages = get_pages(path, range(start_page, end), parallel)
     text_parts = []
     for i in range(start_page, end):
-        page_text = reader.pages[i].extract_text() or ""
+        page_text = pages.get(i, "")
         if page_text.strip():
             text_parts.append(f"[Page {i+1}]\n{page_text}")
     return "\n\n".join(text_parts)
@@ -66,28 +104,71 @@ def extract_pages_by_ranges(path: str, page_ranges: List[Dict]) -> str:
     page_ranges: [{"start": 1, "end": 30}, {"start": 45, "end": 60}]
     Pages are 1-indexed in the input (matching textbook page numbers).
     """
-    reader = PdfReader(path)
-    total = len(reader.pages)
-    text_parts = []
+    total = get_page_count(path)
+    indices = []
     for pr in page_ranges:
         start = max(0, pr.get("start", 1) - 1)
         end = min(pr.get("end", start + 1), total)
-        for i in range(start, end):
-            page_text = reader.pages[i].extract_text() or ""
-            if page_text.strip():
-                text_parts.append(f"[Page {i+1}]\n{page_text}")
+        indices.extend(range(start, end))
+    pages = get_pages(path, indices)
+    text_parts = []
+    for i in indices:
+        page_text = pages.get(i, "")
+        if page_text.strip():
+            text_parts.append(f"[Page {i+1}]\n{page_text}")
     return "\n\n".join(text_parts)
 
 
 def get_total_pages(path: str) -> int:
-    return len(PdfReader(path).pages)
+    return get_page_count(path)
+
+
+# PDF parsing is CPU-bound and blocking, so the async agent wrappers hand it to
+# a worker pool instead of running it on the event loop. PDF_POOL_KIND picks
+# "thread" (default) or "process"; PDF_POOL_MAX_QUEUE bounds how many jobs can
+# be queued or running at once — extra callers wait for a slot.
+PDF_POOL_KIND = os.getenv("PDF_POOL_KIND", "thread")
+PDF_POOL_WORKERS = int(os.getenv("PDF_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_POOL_MAX_QUEUE = int(os.getenv("PDF_POOL_MAX_QUEUE", "32"))
+
+_pdf_executor: Optional[Executor] = None
+_pdf_slots: Optional[asyncio.Semaphore] = None
+
+
+def _get_pdf_executor() -> Executor:
+    global _pdf_executor
+    if _pdf_executor is None:
+        if PDF_POOL_KIND == "process":
+            _pdf_executor = ProcessPoolExecutor(max_workers=PDF_POOL_WORKERS, mp_context=PROCESS_CONTEXT,
+                                                initializer=mark_pool_worker)
+        else:
+            _pdf_executor = ThreadPoolExecutor(max_workers=PDF_POOL_WORKERS, thread_name_prefix="pdf")
+    return _pdf_executor
+
+
+async def run_pdf_job(fn, *args):
+    """Run a blocking PDF function on the worker pool and await its result."""
+    global _pdf_slots
+    if _pdf_slots is None:
+        _pdf_slots = asyncio.Semaphore(PDF_POOL_MAX_QUEUE)
+    async with _pdf_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_pdf_executor(), fn, *args)
+
+
+def shutdown_pdf_pool() -> None:
+    global _pdf_executor
+    if _pdf_executor is not None:
+        _pdf_executor.shutdown(wait=False, cancel_futures=True)
+        _pdf_executor = None
+    shutdown_parallel_pool()
 
 
 # ---------------------------------------------------------------------------
 # FunctionTool functions for StudyGuideGuru
 # ---------------------------------------------------------------------------
 
-def load_textbook_toc(textbook_path: str, max_pages: int = 15) -> str:
+async def load_textbook_toc(textbook_path: str, max_pages: int = 15) -> str:
     """Extract the table of contents (first N pages) from a textbook PDF.
 
     Args:
@@ -99,12 +180,12 @@ def load_textbook_toc(textbook_path: str, max_pages: int = 15) -> str:
     """
     if not os.path.exists(textbook_path):
         return f"Error: file not found at {textbook_path}"
-    total = get_total_pages(textbook_path)
-    text = extract_toc_text(textbook_path, max_pages)
+    total = await run_pdf_job(get_total_pages, textbook_path)
+    text = await run_pdf_job(extract_toc_text, textbook_path, max_pages)
     return f"[Textbook: {total} total pages]\n{text}"
 
 
-def load_textbook_pages(textbook_path: str, page_ranges_json: str) -> str:
+async def load_textbook_pages(textbook_path: str, page_ranges_json: str) -> str:
     """Extract specific page ranges from a textbook PDF.
 
     Args:
@@ -123,7 +204,7 @@ def load_textbook_pages(textbook_path: str, page_ranges_json: str) -> str:
         start = pr.get("start", 1)
         end = min(start + 3, pr.get("end", start + 3))
         clamped.append({"start": start, "end": end})
-    text = extract_pages_by_ranges(textbook_path, clamped)
+    text = await run_pdf_job(extract_pages_by_ranges, textbook_path, clamped)
     if len(text) > 15000:
         text = text[:15000] + "\n[...truncated...]"
     return text
@@ -135,7 +216,7 @@ def load_textbook_pages(textbook_path: str, page_ranges_json: str) -> str:
 
 syllabus_expert = LlmAgent(
     name="SyllabusExpert",
-    model=MODEL_NAME,
+    model=gemini_model,
     instruction=(
         "You are a syllabus analysis expert. Analyze the provided syllabus text and extract course structure.\n"
         "Extract ONLY:\n"
@@ -146,6 +227,7 @@ syllabus_expert = LlmAgent(
         "assessments (array of {type, weight, date}).\n"
         "Be concise."
     ),
+    output_schema=SyllabusResult,
     generate_content_config=types.GenerateContentConfig(
         response_mime_type="application/json",
     ),
@@ -153,7 +235,7 @@ syllabus_expert = LlmAgent(
 
 exam_scope_analyst = LlmAgent(
     name="ExamScopeAnalyst",
-    model=MODEL_NAME,
+    model=gemini_model,
     instruction=(
         "You are an exam scope analyst. Analyze the provided exam guide/midterm overview text.\n"
         "Extract ONLY:\n"
@@ -162,6 +244,7 @@ exam_scope_analyst = LlmAgent(
         "Return valid JSON with keys: exam_date, topics (array of {name, importance}).\n"
         "Be concise."
     ),
+    output_schema=ExamScopeResult,
     generate_content_config=types.GenerateContentConfig(
         response_mime_type="application/json",
     ),
@@ -169,13 +252,14 @@ exam_scope_analyst = LlmAgent(
 
 toc_navigator = LlmAgent(
     name="TocNavigator",
-    model=MODEL_NAME,
+    model=gemini_model,
     instruction=(
         "You are a textbook table-of-contents navigator. Given the TOC text from a textbook and "
         "a list of exam topics, identify which chapters and page ranges are relevant to each topic.\n\n"
         "Return valid JSON with key: relevant_sections (array of {chapter, start_page, end_page, covers_topics}).\n"
         "Only include sections genuinely relevant to the exam topics."
     ),
+    output_schema=TocResult,
     generate_content_config=types.GenerateContentConfig(
         response_mime_type="application/json",
     ),
@@ -183,7 +267,7 @@ toc_navigator = LlmAgent(
 
 study_guide_guru = LlmAgent(
     name="StudyGuideGuru",
-    model=MODEL_NAME,
+    model=gemini_model,
     instruction=(
         "You are a study guide expert that maps exam topics to textbook resources.\n\n"
         "You will be given exam topics, relevant TOC sections, and ALREADY SAMPLED textbook page content.\n"
@@ -202,7 +286,7 @@ study_guide_guru = LlmAgent(
 
 chief_orchestrator = LlmAgent(
     name="ChiefOrchestrator",
-    model=MODEL_NAME,
+    model=gemini_model,
     instruction=(
         "You are the chief study planner. Synthesize all course analysis data into an optimal "
         "day-by-day study schedule.\n\n"
@@ -221,18 +305,14 @@ chief_orchestrator = LlmAgent(
         "The LAST study day for each course MUST be the day BEFORE its exam_date. "
         "If there's not enough time, drop low-importance topics — do NOT exceed the deadline.\n\n"
         "Return ONLY a raw JSON object (no markdown, no ```). The JSON must have a 'tasks' key "
-        "containing an array. Each task object has these STRING fields:\n"
+        "containing an array. Each task object has these fields:\n"
         "  date (YYYY-MM-DD), course (code), topic, task_type (learn/practice/review), "
-        "  duration_hours (number), resources (string), notes (SINGLE flat string, NOT an object).\n\n"
-        "The notes field must be a SINGLE flat string with 4 pipe-separated sections:\n"
-        "  Focus: <what to study> | Practice: <specific problem types> | Memorize: <key formulas/definitions> | Self-Test: <how to verify understanding>\n"
-        "Each section MUST contain real, specific content derived from the actual topic and course material provided above.\n"
-        "Pull actual concepts, formulas, techniques, and terminology from the topics and resources you were given.\n"
-        "NEVER use filler like 'core concepts here', 'problem types here', or 'key formulas'. "
-        "Every word must be meaningful and specific to that topic.\n\n"
+        "  duration_hours (number), resources (string).\n"
+        "Do NOT write study notes — they are generated separately per topic.\n\n"
         "Use the EXACT topic names and resource references provided — do not rephrase them.\n"
         "Generate ALL tasks for ALL topics. Do not stop early."
     ),
+    output_schema=StudyPlanResult,
     generate_content_config=types.GenerateContentConfig(
         max_output_tokens=65536,
         thinking_config=types.ThinkingConfig(thinking_budget=2048),
@@ -240,29 +320,163 @@ chief_orchestrator = LlmAgent(
 )
 
 
+notes_writer = LlmAgent(
+    name="NotesWriter",
+    model=gemini_model,
+    instruction=(
+        "You write concise study notes for exam topics. For EACH topic you are given, write:\n"
+        "  focus: what to study\n"
+        "  practice: specific problem types to work through\n"
+        "  memorize: key formulas/definitions\n"
+        "  self_test: how to verify understanding without notes\n"
+        "Each field MUST contain real, specific content derived from the topic and its textbook resource.\n"
+        "Pull actual concepts, formulas, techniques, and terminology.\n"
+        "NEVER use filler like 'core concepts here', 'problem types here', or 'key formulas'.\n\n"
+        "Return valid JSON with key: notes (array of {topic, focus, practice, memorize, self_test}).\n"
+        "Use the EXACT topic names provided. One or two sentences per field."
+    ),
+    output_schema=NotesResult,
+    generate_content_config=types.GenerateContentConfig(
+        response_mime_type="application/json",
+    ),
+)
+
+
+# Every agent's output is checked against its schema. StudyGuideGuru can't have
+# an output_schema (it has tools), so it's only validated after generation.
+RESPONSE_SCHEMAS: Dict[str, type] = {
+    agent.name: agent.output_schema
+    for agent in (syllabus_expert, exam_scope_analyst, toc_navigator, chief_orchestrator, notes_writer)
+}
+RESPONSE_SCHEMAS[study_guide_guru.name] = StudyGuideResult
+
+
 # ---------------------------------------------------------------------------
-# Core ADK runner — isolated session per call
+# Core ADK runner — isolated session per call, pooled Runner per agent
 # ---------------------------------------------------------------------------
 
-async def run_agent(agent: LlmAgent, user_message: str) -> dict:
-    """Run an ADK agent with a completely isolated session.
+# One session service and one Runner per agent for the life of the process.
+# Sessions are still unique per call and deleted afterwards, so nothing
+# accumulates and no call ever sees another call's history.
+_session_service = InMemorySessionService()
+_runners: Dict[str, Runner] = {}
+
+# Malformed outputs salvaged locally, fixed by a repair call, or given up on
+response_validation = {"recovered": 0, "repaired": 0, "failed": 0}
+
+
+class MalformedResponse(Exception):
+    """An agent's output didn't match its response schema."""
+
+    def __init__(self, agent_name: str, error: str, preview: str = ""):
+        super().__init__(f"{agent_name}: {error}")
+        self.agent_name = agent_name
+        self.error = error
+        self.preview = preview
+
+
+def _conforms(agent: LlmAgent, value: Any) -> bool:
+    schema = RESPONSE_SCHEMAS.get(agent.name)
+    if schema is None:
+        return True
+    try:
+        schema.model_validate(value)
+        return True
+    except ValidationError:
+        return False
+
+
+async def run_agent(agent: LlmAgent, user_message: str, use_cache: bool = True,
+                    stream: Optional[ArrayItemStream] = None) -> dict:
+    """Run an ADK agent, serving repeat prompts from the response cache and
+    coalescing identical concurrent calls into one request.
 
-    Creates a fresh InMemorySessionService per call so there is zero chance
-    of cross-agent session contamination.
+    With `stream`, the response is generated in streaming mode and every text
+    chunk is fed to it as it arrives.
     """
-    session_service = InMemorySessionService()
+    key = cache_key(agent.name, MODEL_NAME, agent.instruction, user_message)
+    if use_cache and LLM_CACHE_ENABLED:
+        cached = llm_cache.get(key)
+        # Entries cached before an agent got its schema may not conform
+        if cached is not None and _conforms(agent, cached):
+            print(f"  [{agent.name}] Cache hit — skipping API call")
+            return cached
+
+    async def call() -> dict:
+        estimated = estimate_tokens(agent.instruction, user_message)
+        try:
+            result, complete = await retry_policy.run(
+                lambda: _run_agent_uncached(agent, user_message, estimated, stream), label=agent.name,
+                acquire=lambda: gemini_limiter.acquire(estimated),
+            )
+        except MalformedResponse as e:
+            result, complete = await _repair_response(agent, user_message, e, stream)
+        # Empty results usually mean a parse failure, and salvaged ones are
+        # missing whatever was truncated — don't pin either in the cache
+        if result and complete and LLM_CACHE_ENABLED:
+            llm_cache.set(key, agent.name, MODEL_NAME, result)
+        return result
 
-    runner = Runner(
-        agent=agent,
-        app_name=APP_NAME,
-        session_service=session_service,
+    if stream is not None:
+        # A streaming caller needs its own chunks, so it can't share another call
+        return await call()
+    return await inflight_calls.do(key, call)
+
+
+async def _repair_response(agent: LlmAgent, user_message: str, failure: MalformedResponse,
+                           stream: Optional[ArrayItemStream] = None) -> Tuple[Any, bool]:
+    """Re-run just the failed call once, telling the model what was wrong."""
+    print(f"  WARNING: {agent.name} output failed validation ({failure.error}) — retrying this call")
+    print(f"  Response preview: {failure.preview}")
+    repair_message = (
+        f"{user_message}\n\n"
+        f"Your previous answer was rejected: {failure.error}\n"
+        f"Answer again with the complete JSON object only, with every required field."
     )
+    estimated = estimate_tokens(agent.instruction, repair_message)
+    try:
+        result, complete = await retry_policy.run(
+            lambda: _run_agent_uncached(agent, repair_message, estimated, stream),
+            label=f"{agent.name} repair", acquire=lambda: gemini_limiter.acquire(estimated),
+        )
+    except MalformedResponse as e:
+        response_validation["failed"] += 1
+        print(f"  WARNING: {agent.name} repair failed too ({e.error})")
+        return {}, False
+    response_validation["repaired"] += 1
+    return result, complete
+
+
+def _get_runner(agent: LlmAgent) -> Runner:
+    runner = _runners.get(agent.name)
+    if runner is None:
+        runner = Runner(
+            agent=agent,
+            app_name=APP_NAME,
+            session_service=_session_service,
+        )
+        _runners[agent.name] = runner
+    return runner
+
+
+async def _run_agent_uncached(agent: LlmAgent, user_message: str, estimated: int,
+                              stream: Optional[ArrayItemStream] = None) -> Tuple[Any, bool]:
+    """Run an ADK agent in its own throwaway session on a pooled Runner.
+
+    The caller has already reserved `estimated` tokens on gemini_limiter
+    (retry_policy.run does it per attempt, outside the call deadline).
+
+    Every call gets a unique user/session id and the session is deleted when
+    the call ends, so there is zero chance of cross-agent session
+    contamination — but the Runner and Gemini client are reused.
+    """
+    runner = _get_runner(agent)
 
     call_id = uuid.uuid4().hex[:12]
     user_id = f"user_{call_id}"
     session_id = f"session_{call_id}"
 
-    session = await session_service.create_session(
+    await _session_service.create_session(
         app_name=APP_NAME,
         user_id=user_id,
         session_id=session_id,
@@ -273,95 +487,173 @@ async def run_agent(agent: LlmAgent, user_message: str) -> dict:
         parts=[types.Part(text=user_message)],
     )
 
-    # Wait for rate limit before hitting the API
-    await _rate_limit()
-
     final_text = ""
-    async for event in runner.run_async(
-        user_id=user_id,
-        session_id=session_id,
-        new_message=user_content,
-    ):
-        if hasattr(event, "usage_metadata") and event.usage_metadata:
-            u = event.usage_metadata
-            print(f"  [{agent.name}] Tokens — In: {getattr(u, 'prompt_token_count', '?')}, "
-                  f"Out: {getattr(u, 'candidates_token_count', '?')}")
-
-        if event.is_final_response() and event.content and event.content.parts:
-            final_text = "".join(p.text for p in event.content.parts if p.text)
-
-    # Try to parse the final response as JSON
-    if final_text:
-        try:
-            return json.loads(final_text)
-        except json.JSONDecodeError:
-            # Try extracting JSON from markdown code blocks
-            if "```json" in final_text:
-                json_block = final_text.split("```json")[1].split("```")[0].strip()
-                try:
-                    return json.loads(json_block)
-                except json.JSONDecodeError:
-                    pass
-            elif "```" in final_text:
-                json_block = final_text.split("```")[1].split("```")[0].strip()
-                try:
-                    return json.loads(json_block)
-                except json.JSONDecodeError:
-                    pass
+    used_tokens = 0
+    partial_tokens = 0  # usage reported so far by the turn still streaming
+    # Everything after create_session is inside the try, so a cancelled call
+    # always deletes its session
+    try:
+        if stream is not None:
+            stream.reset()  # a retry starts the response over
+        run_config = RunConfig(streaming_mode=StreamingMode.SSE) if stream is not None else None
+
+        async for event in runner.run_async(
+            user_id=user_id,
+            session_id=session_id,
+            new_message=user_content,
+            run_config=run_config,
+        ):
+            if stream is not None and event.partial and event.content and event.content.parts:
+                stream.feed("".join(p.text for p in event.content.parts if p.text and not p.thought))
+
+            if hasattr(event, "usage_metadata") and event.usage_metadata:
+                u = event.usage_metadata
+                if event.partial:
+                    # In SSE mode every chunk repeats the running usage and the
+                    # turn's aggregated event carries it again — count it once
+                    partial_tokens = getattr(u, "total_token_count", None) or partial_tokens
+                else:
+                    print(f"  [{agent.name}] Tokens — In: {getattr(u, 'prompt_token_count', '?')}, "
+                          f"Out: {getattr(u, 'candidates_token_count', '?')}")
+                    # Tool-using agents make several LLM turns, one aggregated event each
+                    used_tokens += (getattr(u, "total_token_count", None) or 0)
+                    partial_tokens = 0
+
+            if event.is_final_response() and event.content and event.content.parts:
+                final_text = "".join(p.text for p in event.content.parts if p.text)
+    except asyncio.CancelledError:
+        # Plan cancelled mid-call: hand the unused token reservation back now
+        gemini_limiter.release(estimated, used_tokens + partial_tokens)
+        raise
+    finally:
+        await _session_service.delete_session(
+            app_name=APP_NAME,
+            user_id=user_id,
+            session_id=session_id,
+        )
+
+    gemini_limiter.record_usage(estimated, used_tokens or estimated)
+
+    return parse_response(agent, final_text)
+
+
+def _recover(agent: LlmAgent, text: str) -> Tuple[Optional[Any], bool]:
+    """Tolerant parse (see json_stream.recover_json), logging what was salvaged.
+
+    Returns (value, complete); complete is False when truncated items were dropped.
+    """
+    value, report = recover_json(text)
+    if report["method"] in ("trailing_commas", "truncated"):
+        response_validation["recovered"] += 1
+        print(f"  [{agent.name}] Recovered {report['items']} items from a malformed response "
+              f"({report['method']}, {report['chars_dropped']} of {report['chars_total']} chars dropped)")
+    return value, report["method"] != "truncated"
+
+
+def _describe_errors(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in err['loc']) or 'response'}: {err['msg']}" for err in e.errors()[:5]
+    )
+
+
+def parse_response(agent: LlmAgent, text: str) -> Tuple[Any, bool]:
+    """Parse an agent's final text, validating it against the agent's schema.
+
+    Returns (value, complete). Raises MalformedResponse when a schema'd
+    agent's output doesn't conform.
+    """
+    schema = RESPONSE_SCHEMAS.get(agent.name)
+    if schema is None:
+        parsed, complete = _recover(agent, text) if text else (None, False)
+        if parsed is None:
             print(f"  WARNING: Could not parse {agent.name} response as JSON")
-            print(f"  Response preview: {final_text[:300]}")
-            return {}
+            print(f"  Response preview: {text[:300]}")
+            return {}, False
+        return parsed, complete
+
+    if not text:
+        raise MalformedResponse(agent.name, "empty response")
+    # Fast path: pydantic parses and validates the raw JSON in one pass
+    try:
+        return schema.model_validate_json(text).model_dump(), True
+    except ValidationError as e:
+        error = e
+    parsed, complete = _recover(agent, text)
+    if isinstance(parsed, list) and len(schema.model_fields) == 1:
+        # A bare array where the schema wants {"tasks": [...]} etc.
+        parsed = {next(iter(schema.model_fields)): parsed}
+    if parsed is not None:
+        try:
+            return schema.model_validate(parsed).model_dump(), complete
+        except ValidationError as e:
+            error = e
+    raise MalformedResponse(agent.name, _describe_errors(error), text[:300])
 
-    print(f"  WARNING: {agent.name} returned empty response")
-    return {}
+
+async def run_typed(agent: LlmAgent, user_message: str, **kwargs) -> Optional[BaseModel]:
+    """run_agent, returning the agent's schema object (None if the call failed)."""
+    result = await run_agent(agent, user_message, **kwargs)
+    if not result:
+        return None
+    return RESPONSE_SCHEMAS[agent.name].model_validate(result)
 
 
 # ---------------------------------------------------------------------------
 # Public async wrapper functions (called by main.py)
 # ---------------------------------------------------------------------------
 
-async def analyze_syllabus(syllabus_paths: List[str]) -> dict:
-    """Run SyllabusExpert on locally-extracted PDF text."""
-    if not syllabus_paths:
-        return {"course_name": "", "modules": [], "assessments": []}
-
+async def extract_documents_text(paths: List[str]) -> str:
+    """Extract and concatenate every PDF, each headed by its filename."""
     all_text = []
-    for path in syllabus_paths:
-        text = extract_pdf_text(path)
+    for path in paths:
+        text = await run_pdf_job(extract_pdf_text, path)
         all_text.append(f"--- {os.path.basename(path)} ---\n{text}")
-    combined = "\n\n".join(all_text)
+    return "\n\n".join(all_text)
+
+
+async def analyze_syllabus(syllabus_paths: List[str], text: Optional[str] = None) -> Tuple[dict, bool]:
+    """Run SyllabusExpert on locally-extracted PDF text.
+
+    Pass `text` when the syllabus has already been extracted (see
+    extract_documents_text) to skip re-reading the PDFs. Returns (info, ok);
+    ok is False when the agent failed and `info` is an empty fallback.
+    """
+    if not syllabus_paths:
+        return {"course_name": "", "modules": [], "assessments": []}, True
+
+    combined = text if text is not None else await extract_documents_text(syllabus_paths)
 
     print(f"\n--- [SyllabusExpert] PDF text: {len(combined)} chars ---")
-    result = await run_agent(syllabus_expert, f"Analyze this syllabus:\n\n{combined}")
+    result = await run_typed(syllabus_expert, f"Analyze this syllabus:\n\n{combined}")
 
-    if not isinstance(result, dict):
-        return {"course_name": "", "modules": [], "assessments": []}
-    return result
+    if result is None:
+        return {"course_name": "", "modules": [], "assessments": []}, False
+    return result.model_dump(), True
 
 
-async def analyze_exam_scope(overview_paths: List[str]) -> dict:
-    """Run ExamScopeAnalyst on locally-extracted PDF text."""
+async def analyze_exam_scope(overview_paths: List[str]) -> Tuple[dict, bool]:
+    """Run ExamScopeAnalyst on locally-extracted PDF text. Returns (scope, ok)."""
     if not overview_paths:
-        return {"exam_date": "", "topics": []}
+        return {"exam_date": "", "topics": []}, True
 
-    all_text = []
-    for path in overview_paths:
-        text = extract_pdf_text(path)
-        all_text.append(f"--- {os.path.basename(path)} ---\n{text}")
-    combined = "\n\n".join(all_text)
+    combined = await extract_documents_text(overview_paths)
 
     print(f"\n--- [ExamScopeAnalyst] PDF text: {len(combined)} chars ---")
-    result = await run_agent(exam_scope_analyst, f"Analyze this exam guide:\n\n{combined}")
+    result = await run_typed(exam_scope_analyst, f"Analyze this exam guide:\n\n{combined}")
+
+    if result is None:
+        return {"exam_date": "", "topics": []}, False
+    return result.model_dump(), True
 
-    if not isinstance(result, dict):
-        return {"exam_date": "", "topics": []}
-    return result
 
+async def analyze_textbook(textbook_paths: List[str], topics: List) -> Tuple[list, bool]:
+    """Two-pass textbook analysis: TocNavigator → StudyGuideGuru.
 
-async def analyze_textbook(textbook_paths: List[str], topics: List) -> list:
-    """Two-pass textbook analysis: TocNavigator → StudyGuideGuru."""
+    Returns (mappings, ok); ok is False when either agent failed and the
+    mappings are placeholders.
+    """
     if not textbook_paths:
-        return []
+        return [], True
 
     topic_names = []
     for t in topics:
@@ -371,14 +663,14 @@ async def analyze_textbook(textbook_paths: List[str], topics: List) -> list:
             topic_names.append(str(t))
 
     if not topic_names:
-        return []
+        return [], True
 
     textbook_path = textbook_paths[0]
-    total_pages = get_total_pages(textbook_path)
+    total_pages = await run_pdf_job(get_total_pages, textbook_path)
 
     # --- PASS 1: TocNavigator scans TOC ---
     print(f"\n--- [TocNavigator] Scanning TOC ({total_pages} total pages) ---")
-    toc_text = extract_toc_text(textbook_path, max_pages=15)
+    toc_text = await run_pdf_job(extract_toc_text, textbook_path, 15)
 
     toc_message = (
         f"Table of contents of a {total_pages}-page textbook.\n\n"
@@ -387,24 +679,24 @@ async def analyze_textbook(textbook_paths: List[str], topics: List) -> list:
         f"TOC:\n{toc_text}"
     )
 
-    toc_result = await run_agent(toc_navigator, toc_message)
-    sections = toc_result.get("relevant_sections", [])
+    toc_result = await run_typed(toc_navigator, toc_message)
+    sections = toc_result.relevant_sections if toc_result is not None else []
     print(f"[TocNavigator] Found {len(sections)} relevant sections")
 
     if not sections:
         return [{"topic": t, "resource": "Textbook (section not identified)", "estimated_hours": 2.0}
-                for t in topic_names]
+                for t in topic_names], toc_result is not None
 
     # --- PASS 2: StudyGuideGuru maps topics using pre-extracted pages ---
     # Pre-extract pages here to avoid tool call round-trips (saves API calls for rate limit)
     page_ranges = [
-        {"start": s.get("start_page", 1), "end": min(s.get("start_page", 1) + 3, s.get("end_page", 10))}
+        {"start": s.start_page, "end": min(s.start_page + 3, s.end_page)}
         for s in sections
     ]
     sampled_count = sum(pr["end"] - pr["start"] + 1 for pr in page_ranges)
     print(f"\n--- [StudyGuideGuru] Mapping {len(topic_names)} topics, sampling {sampled_count} pages ---")
 
-    relevant_text = extract_pages_by_ranges(textbook_path, page_ranges)
+    relevant_text = await run_pdf_job(extract_pages_by_ranges, textbook_path, page_ranges)
     if len(relevant_text) > 15000:
         relevant_text = relevant_text[:15000] + "\n[...truncated...]"
 
@@ -412,23 +704,21 @@ async def analyze_textbook(textbook_paths: List[str], topics: List) -> list:
         f"Map exam topics to textbook resources.\n\n"
         f"TOPICS: {json.dumps(topic_names)}\n\n"
         f"RELEVANT SECTIONS (from table of contents analysis):\n"
-        f"{json.dumps(sections, indent=2)}\n\n"
+        f"{json.dumps([s.model_dump() for s in sections], indent=2)}\n\n"
         f"SAMPLED TEXTBOOK CONTENT:\n{relevant_text}\n\n"
         f"Map each topic to specific textbook resources with estimated study hours.\n"
         f"Return JSON with a mappings array."
     )
 
-    guide_result = await run_agent(study_guide_guru, guide_message)
+    guide_result = await run_typed(study_guide_guru, guide_message)
 
-    if isinstance(guide_result, dict) and "mappings" in guide_result:
-        return guide_result["mappings"]
-    if isinstance(guide_result, list):
-        return guide_result
-    return []
+    if guide_result is None:
+        return [], False
+    return [m.model_dump() for m in guide_result.mappings], True
 
 
-async def generate_study_plan(courses_data: List[Dict], constraints: Dict) -> list:
-    """Run ChiefOrchestrator to generate the final study schedule."""
+def compress_courses(courses_data: List[Dict]) -> List[Dict]:
+    """Boil per-course analysis down to {code, exam_date, topics[{topic, importance, resource, hours}]}."""
     compressed = []
     for cd in courses_data:
         course = cd.get("course", {})
@@ -464,6 +754,29 @@ async def generate_study_plan(courses_data: List[Dict], constraints: Dict) -> li
             "exam_date": exam_date or "unknown",
             "topics": topics_summary,
         })
+    return compressed
+
+
+def plan_locally(courses_data: List[Dict], constraints: Dict) -> Dict:
+    """Schedule with the local engine instead of ChiefOrchestrator (no LLM call).
+
+    Returns {"tasks": [...], "dropped": [...]} — see scheduler.schedule_locally.
+    """
+    return schedule_locally(compress_courses(courses_data), constraints)
+
+
+# Stream ChiefOrchestrator output so finished tasks reach the UI mid-generation
+PLAN_STREAMING = os.getenv("PLAN_STREAMING", "1") == "1"
+
+
+async def generate_study_plan(courses_data: List[Dict], constraints: Dict,
+                              on_task: Optional[Callable[[int, Dict], None]] = None) -> list:
+    """Run ChiefOrchestrator to generate the final study schedule.
+
+    `on_task(index, task)` is called for each task as soon as it has streamed
+    in; a retried call repeats indices from 0.
+    """
+    compressed = compress_courses(courses_data)
 
     today_str = datetime.now().strftime("%Y-%m-%d")
     tomorrow_str = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
@@ -481,10 +794,103 @@ async def generate_study_plan(courses_data: List[Dict], constraints: Dict) -> li
         f"Return a JSON object with a 'tasks' key containing the array of study tasks."
     )
 
-    result = await run_agent(chief_orchestrator, plan_message)
+    stream = ArrayItemStream(on_task) if on_task is not None and PLAN_STREAMING else None
+    result = await run_typed(chief_orchestrator, plan_message, stream=stream)
 
-    if isinstance(result, dict) and "tasks" in result:
-        return result["tasks"]
-    if isinstance(result, list):
-        return result
-    return []
+    if result is None:
+        return []
+    return [t.model_dump() for t in result.tasks]
+
+
+async def generate_sharded_plan(courses_data: List[Dict], constraints: Dict,
+                                on_task: Optional[Callable[[str, Dict], None]] = None) -> list:
+    """One ChiefOrchestrator call per course, in parallel, merged into one plan.
+
+    Each shard gets its own slice of the daily hour budget (see
+    split_hour_budget), so the merged plan stays within budget; callers should
+    still run validate_and_repair over the result to catch any conflicts.
+    """
+    shard_constraints = split_hour_budget(compress_courses(courses_data), constraints)
+    print(f"\n--- [ChiefOrchestrator] Sharded into {len(courses_data)} per-course calls ---")
+
+    def shard_callback(code: str):
+        if on_task is None:
+            return None
+        return lambda index, task: on_task(f"{code}:{index}", task)
+
+    results = await asyncio.gather(*(
+        generate_study_plan([cd], shard_constraints.get(code, constraints), shard_callback(code))
+        for cd in courses_data
+        for code in [cd.get("course", {}).get("code", "COURSE")]
+    ))
+    merged = [task for shard in results for task in shard]
+    merged.sort(key=lambda t: (str(t.get("date", "")), str(t.get("course", ""))) if isinstance(t, dict) else ("", ""))
+    return merged
+
+
+# Notes are written once per (course, topic) — not per task — in small
+# per-course batches that run in parallel and are cached like any other call,
+# then copied onto every learn/practice/review task for that topic.
+NOTES_BATCH_SIZE = int(os.getenv("NOTES_BATCH_SIZE", "8"))
+
+
+def format_notes(entry: Dict) -> str:
+    sections = [("Focus", "focus"), ("Practice", "practice"), ("Memorize", "memorize"), ("Self-Test", "self_test")]
+    return " | ".join(f"{label}: {entry[key]}" for label, key in sections if entry.get(key))
+
+
+async def generate_topic_notes(course_code: str, topics: List[Dict]) -> Dict[str, str]:
+    """Run NotesWriter for one batch of a course's topics. Returns {topic: notes}."""
+    message = (
+        f"Course: {course_code}\n\n"
+        f"TOPICS:\n{json.dumps([{'topic': t['topic'], 'resource': t.get('resource', '')} for t in topics])}\n\n"
+        f"Write study notes for every topic."
+    )
+    result = await run_typed(notes_writer, message)
+    notes = {}
+    for e in (result.notes if result is not None else []):
+        if e.topic:
+            notes[e.topic.lower()] = format_notes(e.model_dump())
+    return notes
+
+
+async def write_topic_notes(compressed: List[Dict]) -> Dict[tuple, str]:
+    """One NotesWriter pass over every (course, topic). Returns {(course, topic_lower): notes}.
+
+    Only depends on the topic list, not the schedule, so it can run alongside
+    ChiefOrchestrator.
+    """
+    batches = []
+    for c in compressed:
+        topics = c.get("topics", [])
+        for i in range(0, len(topics), NOTES_BATCH_SIZE):
+            batches.append((c.get("code", ""), topics[i:i + NOTES_BATCH_SIZE]))
+
+    async def batch_notes(code: str, topics: List[Dict]) -> Dict[str, str]:
+        # Notes are an extra: a failed batch leaves its tasks with default notes
+        # instead of failing a plan whose schedule is already done
+        try:
+            return await generate_topic_notes(code, topics)
+        except Exception as e:
+            print(f"  WARNING: NotesWriter failed for {code} ({len(topics)} topics): {e}")
+            return {}
+
+    print(f"\n--- [NotesWriter] {sum(len(t) for _, t in batches)} topics in {len(batches)} calls ---")
+    results = await asyncio.gather(*(batch_notes(code, topics) for code, topics in batches))
+    notes: Dict[tuple, str] = {}
+    for (code, _), topic_notes in zip(batches, results):
+        for topic, text in topic_notes.items():
+            notes[(code, topic)] = text
+    return notes
+
+
+def apply_notes(tasks: List[Dict], notes: Dict[tuple, str]) -> List[Dict]:
+    """Copy each topic's notes onto all of its learn/practice/review tasks.
+
+    Topics NotesWriter didn't cover keep their notes, or get scheduler.default_notes.
+    """
+    for t in tasks:
+        if isinstance(t, dict):
+            t["notes"] = notes.get((t.get("course", ""), t.get("topic", "").lower())) or t.get("notes") or \
+                default_notes(t.get("course", ""), t.get("topic", ""), t.get("task_type", ""), t.get("resources", ""))
+    return tasks
@@ -0,0 +1,115 @@
+import os
+import json
+import shutil
+import hashlib
+from typing import Any, Dict, List, Optional
+
+from pdf_cache import file_digest
+
+# ---------------------------------------------------------------------------
+# Stage checkpoints — resume a failed plan without redoing finished LLM calls
+# ---------------------------------------------------------------------------
+#
+# Layout under sessions/<sessionId>/_checkpoints/:
+#   request.json                 the PlanRequest that started the workflow
+#   <courseId>/<stage>.json      output of each completed course stage
+#   <courseId>/fingerprint.json  hash of the course fields + upload contents
+#   plan.json                    the final ChiefOrchestrator plan
+#
+# Every file is written atomically (tmp + rename), so a crash mid-write never
+# leaves a half checkpoint behind.
+#
+# Course checkpoints double as a memo for re-planning: when only constraints
+# change, each course's fingerprint still matches and its analysis is reused,
+# so just ChiefOrchestrator runs again. Changing a course's files (or its exam
+# date) changes its fingerprint and invalidates only that course.
+
+CHECKPOINT_DIRNAME = "_checkpoints"
+
+
+def _write_json(path: str, value: Any) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> Optional[Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class SessionCheckpoints:
+    def __init__(self, upload_dir: str, session_id: str):
+        self.root = os.path.join(upload_dir, session_id, CHECKPOINT_DIRNAME)
+
+    def clear(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def save_request(self, request: Dict) -> None:
+        _write_json(os.path.join(self.root, "request.json"), request)
+
+    def load_request(self) -> Optional[Dict]:
+        return _read_json(os.path.join(self.root, "request.json"))
+
+    def clear_plan(self) -> None:
+        try:
+            os.remove(os.path.join(self.root, "plan.json"))
+        except FileNotFoundError:
+            pass
+
+    def save_plan(self, plan: Any) -> None:
+        _write_json(os.path.join(self.root, "plan.json"), plan)
+
+    def load_plan(self) -> Optional[Any]:
+        return _read_json(os.path.join(self.root, "plan.json"))
+
+    def course(self, course_id: str) -> "CourseCheckpoint":
+        return CourseCheckpoint(os.path.join(self.root, course_id))
+
+
+def course_fingerprint(course: Dict, uploads: Dict[str, List[str]]) -> str:
+    """Hash of everything a course's analysis depends on: its fields and file contents."""
+    h = hashlib.sha256()
+    h.update(json.dumps(
+        {k: course.get(k, "") for k in ("code", "name", "examDate")}, sort_keys=True
+    ).encode("utf-8"))
+    for doc_type in sorted(uploads):
+        for path in sorted(uploads[doc_type]):
+            h.update(f"\n{doc_type}/{os.path.basename(path)}:{file_digest(path)}".encode("utf-8"))
+    return h.hexdigest()
+
+
+class CourseCheckpoint:
+    """Stage output store for one course; plugs into StageGraph.run(checkpoint=...)."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.restored: List[str] = []
+
+    def _path(self, stage: str) -> str:
+        return os.path.join(self.root, f"{stage}.json")
+
+    def validate(self, fingerprint: str) -> bool:
+        """Keep saved stages only if they were computed from the same inputs."""
+        saved = _read_json(self._path("fingerprint"))
+        if saved is not None and saved.get("value") == fingerprint:
+            return True
+        shutil.rmtree(self.root, ignore_errors=True)
+        _write_json(self._path("fingerprint"), {"value": fingerprint})
+        return False
+
+    def load(self, stage: str) -> Optional[Any]:
+        saved = _read_json(self._path(stage))
+        if saved is None:
+            return None
+        self.restored.append(stage)
+        return saved["value"]
+
+    def save(self, stage: str, value: Any) -> None:
+        # Wrapped so a stage that legitimately returned null/[] still counts as done
+        _write_json(self._path(stage), {"value": value})
@@ -0,0 +1,230 @@
+import math
+import time
+import uuid
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+# ---------------------------------------------------------------------------
+# Plan job queue — fixed worker pool with admission control
+# ---------------------------------------------------------------------------
+#
+# /api/plan used to start a workflow per request with no limit, so a traffic
+# spike meant hundreds of workflows fighting over one rate limiter. Now a
+# request becomes a Job in a bounded FIFO queue, and `workers` coroutines run
+# jobs one at a time each. Past `max_depth` waiting jobs, submit() raises
+# QueueFull with a retry estimate instead of accepting more work than the
+# Gemini quota could ever serve.
+#
+# ETAs come from a moving average of recent job durations.
+#
+# Each job carries a `key` (the caller's hash of what it was asked to do), so
+# callers can tell a duplicate submission from a changed one, and cancel()
+# stops a queued or running job so a newer one can supersede it.
+#
+# `on_change(job)` is called on every state change, so the state can be
+# mirrored somewhere other processes can read it.
+#
+# Finished jobs stay readable through get()/status() until forget() is called.
+
+
+class QueueFull(Exception):
+    def __init__(self, depth: int, retry_after: float):
+        super().__init__(f"Plan queue is full ({depth} waiting)")
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class QueueClosed(Exception):
+    """The queue is shutting down and not accepting jobs."""
+
+
+class Job:
+    def __init__(self, job_id: str, run: Callable[[], Awaitable[Any]], key: str = ""):
+        self.id = job_id
+        self.run_id = uuid.uuid4().hex  # tells this run apart from later ones for the same id
+        self.run = run
+        self.key = key
+        self.state = "queued"  # queued → running → done / failed / cancelled
+        self.enqueued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_requested = False
+
+    @property
+    def active(self) -> bool:
+        return self.state in ("queued", "running")
+
+
+class JobQueue:
+    def __init__(self, workers: int, max_depth: int, initial_duration: float = 120.0,
+                 on_change: Optional[Callable[[Job], None]] = None):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.on_change = on_change
+        self._pending: Deque[Job] = deque()
+        self._jobs: Dict[str, Job] = {}
+        self._running: List[Job] = []
+        self._workers: List[asyncio.Task] = []
+        self._ready: Optional[asyncio.Condition] = None
+        self._closed = False
+        self.avg_duration = initial_duration
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    def _start(self) -> None:
+        # Created on first use so everything binds to the server's event loop
+        if self._ready is None:
+            self._ready = asyncio.Condition()
+            self._workers = [asyncio.create_task(self._worker(), name=f"plan-worker-{i}")
+                             for i in range(self.workers)]
+
+    async def submit(self, job_id: str, run: Callable[[], Awaitable[Any]], key: str = "") -> Job:
+        """Queue `run()` under `job_id`. Raises QueueFull / QueueClosed."""
+        if self._closed:
+            raise QueueClosed()
+        if len(self._pending) >= self.max_depth:
+            self.rejected += 1
+            raise QueueFull(len(self._pending), self.slot_wait())
+        self._start()
+        job = Job(job_id, run, key)
+        self._jobs[job_id] = job
+        async with self._ready:
+            self._pending.append(job)
+            self._ready.notify()
+        self._changed(job)
+        return job
+
+    def _changed(self, job: Job) -> None:
+        if self.on_change is not None:
+            try:
+                self.on_change(job)
+            except Exception as e:
+                print(f"  [JobQueue] on_change failed for {job.id}: {e}")
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._ready:
+                while not self._pending:
+                    await self._ready.wait()
+                job = self._pending.popleft()
+            job.state = "running"
+            job.started_at = time.time()
+            self._running.append(job)
+            job.task = asyncio.create_task(job.run())
+            self._changed(job)
+            try:
+                await job.task
+                job.state = "done"
+                self.completed += 1
+            except asyncio.CancelledError:
+                if not job.cancel_requested:
+                    raise  # the worker itself is being shut down
+                job.state = "cancelled"
+                self.cancelled += 1
+            except Exception as e:
+                job.state = "failed"
+                job.error = str(e)
+                self.failed += 1
+            finally:
+                job.finished_at = time.time()
+                self._running.remove(job)
+                if job.state == "done":
+                    # Exponential moving average of how long a plan takes
+                    self.avg_duration = 0.8 * self.avg_duration + 0.2 * (job.finished_at - job.started_at)
+                self._changed(job)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def cancel(self, job_id: str) -> bool:
+        """Stop a queued or running job; waits until a running one has unwound."""
+        job = self._jobs.get(job_id)
+        if job is None or not job.active:
+            return False
+        job.cancel_requested = True
+        if job.state == "queued":
+            self._pending.remove(job)
+            job.state = "cancelled"
+            job.finished_at = time.time()
+            self.cancelled += 1
+            self._changed(job)
+            return True
+        job.task.cancel()
+        await asyncio.wait([job.task])
+        return True
+
+    def active_jobs(self) -> List[Job]:
+        return list(self._running) + list(self._pending)
+
+    def finished_jobs(self) -> List[Job]:
+        return [job for job in self._jobs.values() if not job.active]
+
+    def forget(self, job_id: str) -> bool:
+        """Drop a finished job so the queue doesn't hold every job it ever ran."""
+        job = self._jobs.get(job_id)
+        if job is None or job.active:
+            return False
+        del self._jobs[job_id]
+        return True
+
+    def slot_wait(self) -> float:
+        """Rough seconds until the queue has room again."""
+        return self.avg_duration / max(self.workers, 1)
+
+    def position(self, job: Job) -> Optional[int]:
+        """1-based place in line, or None if the job isn't waiting."""
+        for i, pending in enumerate(self._pending):
+            if pending is job:
+                return i + 1
+        return None
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        status = {
+            "state": job.state,
+            "position": self.position(job),
+            "queued_at": job.enqueued_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+            "eta_seconds": None,
+        }
+        if job.state == "queued":
+            # Each wave of `workers` jobs ahead of us costs one average duration
+            ahead = status["position"] - 1
+            free = max(self.workers - len(self._running), 0)
+            waves = 0 if ahead < free else math.floor((ahead - free) / self.workers) + 1
+            status["eta_seconds"] = round((waves + 1) * self.avg_duration)
+        elif job.state == "running":
+            status["eta_seconds"] = round(max(self.avg_duration - (time.time() - job.started_at), 0))
+        elif job.error:
+            status["error"] = job.error
+        return status
+
+    async def shutdown(self) -> None:
+        self._closed = True
+        for job in list(self._running):
+            if job.task is not None:
+                job.task.cancel()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def metrics(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "max_depth": self.max_depth,
+            "queued": len(self._pending),
+            "running": len(self._running),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "avg_duration_s": round(self.avg_duration, 1),
+        }
@@ -0,0 +1,244 @@
+import re
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ---------------------------------------------------------------------------
+# Incremental JSON array scanner — emit array items while the model streams
+# ---------------------------------------------------------------------------
+#
+# ChiefOrchestrator returns {"tasks": [{...}, {...}, ...]}. Fed the response
+# chunk by chunk, ArrayItemStream finds the first array in the text and hands
+# back each object in it as soon as its closing brace arrives, so the first
+# task reaches the UI seconds into a generation that takes a minute.
+#
+# It only tracks nesting depth and string/escape state; each completed item is
+# parsed with json.loads, and an item that doesn't parse is skipped (the final
+# response is still parsed in full once the stream ends).
+
+
+class ArrayItemStream:
+    def __init__(self, on_item: Optional[Callable[[int, Any], None]] = None):
+        self.on_item = on_item
+        self.reset()
+
+    def reset(self) -> None:
+        """Start over (e.g. when a failed call is retried from scratch)."""
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._array_depth: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._closed = False
+        self.count = 0
+        self.skipped = 0
+
+    def feed(self, chunk: str) -> List[Tuple[int, Any]]:
+        """Consume more text; return (index, item) for every item it completed."""
+        items = []
+        self._buf += chunk
+        buf = self._buf
+        i = self._pos
+        while i < len(buf) and not self._closed:
+            ch = buf[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+            elif ch == '"':
+                self._in_str = True
+            elif ch in "[{":
+                self._depth += 1
+                if ch == "[" and self._array_depth is None:
+                    self._array_depth = self._depth
+                elif ch == "{" and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._item_start = i
+            elif ch in "]}":
+                if ch == "}" and self._item_start is not None and self._depth == self._array_depth + 1:
+                    try:
+                        item = json.loads(buf[self._item_start:i + 1])
+                    except ValueError:
+                        self.skipped += 1
+                    else:
+                        items.append((self.count, item))
+                        self.count += 1
+                    self._item_start = None
+                elif ch == "]" and self._depth == self._array_depth:
+                    self._closed = True
+                self._depth -= 1
+            i += 1
+
+        # Drop text we'll never need again so long responses don't pile up
+        keep = self._item_start if self._item_start is not None else i
+        self._buf = buf[keep:]
+        self._pos = i - keep
+        if self._item_start is not None:
+            self._item_start = 0
+
+        if self.on_item is not None:
+            for index, item in items:
+                self.on_item(index, item)
+        return items
+
+
+# ---------------------------------------------------------------------------
+# Tolerant recovery for truncated or slightly malformed JSON
+# ---------------------------------------------------------------------------
+#
+# A response cut off by max_output_tokens used to be thrown away whole. This
+# recovers as much as is safely possible:
+#
+#   1. strip markdown fences and any commentary around the JSON
+#   2. drop trailing commas ("[1, 2,]")
+#   3. if the text is truncated, cut it back to the last complete array item
+#      and close every bracket still open
+#
+# Only whole array items are kept — a half-written task is dropped rather than
+# returned with missing fields. Tokens are found with one regex, which skips
+# over string contents in C, so this stays fast on 100 KB+ plans.
+
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*(?P<closed>"?)|[\[\]{},]')
+
+
+def _strip_wrapping(text: str) -> str:
+    """The JSON inside a fenced block or surrounding prose."""
+    if "```" in text:
+        after = text.split("```json", 1)[1] if "```json" in text else text.split("```", 1)[1]
+        text = after.split("```", 1)[0]
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        return text.strip()
+    text = text[min(starts):]
+    end = max(text.rfind("}"), text.rfind("]"))
+    # Keep everything if the JSON is truncated; trailing prose is cut otherwise
+    tail = text[end + 1:] if end != -1 else ""
+    if end != -1 and '"' not in tail and "{" not in tail and "[" not in tail:
+        text = text[:end + 1]
+    return text.strip()
+
+
+def _remove_at(text: str, positions: List[int]) -> str:
+    """`text` without the characters at `positions` (ascending)."""
+    parts, prev = [], 0
+    for i in positions:
+        parts.append(text[prev:i])
+        prev = i + 1
+    parts.append(text[prev:])
+    return "".join(parts)
+
+
+def _first_list_len(value: Any) -> int:
+    if isinstance(value, list):
+        return len(value)
+    if isinstance(value, dict):
+        for v in value.values():
+            if isinstance(v, list):
+                return len(v)
+    return 0
+
+
+def recover_json(text: str) -> Tuple[Optional[Any], Dict[str, Any]]:
+    """Parse `text` as leniently as is safe. Returns (value or None, report).
+
+    The report says how the value was obtained ("exact", "unwrapped",
+    "trailing_commas" or "truncated"), how many items the main array holds,
+    and how many characters had to be discarded.
+    """
+    report = {"method": None, "items": 0, "chars_total": len(text), "chars_dropped": 0}
+    try:
+        value = json.loads(text)
+        report.update(method="exact", items=_first_list_len(value))
+        return value, report
+    except ValueError:
+        pass
+
+    body = _strip_wrapping(text)
+    try:
+        value = json.loads(body)
+        report.update(method="unwrapped", items=_first_list_len(value),
+                      chars_dropped=len(text) - len(body))
+        return value, report
+    except ValueError:
+        pass
+
+    # One pass over the tokens: find trailing commas and the last place the
+    # text can be cut (right after a complete array item or top-level value)
+    stack: List[str] = []
+    drop_commas: List[int] = []
+    last_comma: Optional[int] = None
+    cut: Optional[Tuple[int, str]] = None
+    for m in _TOKEN.finditer(body):
+        tok = m.group()
+        pos = m.start()
+        if tok == ",":
+            last_comma = pos
+            continue
+        if tok in "]}" and last_comma is not None and not body[last_comma + 1:pos].strip():
+            drop_commas.append(last_comma)
+        last_comma = None
+        if tok in "[{":
+            stack.append("]" if tok == "[" else "}")
+        elif tok in "]}":
+            if not stack or stack[-1] != tok:
+                break  # mismatched bracket — everything after it is suspect
+            stack.pop()
+            if not stack or stack[-1] == "]":
+                cut = (m.end(), "".join(reversed(stack)))
+        elif tok[0] == '"' and not m.group("closed"):
+            break  # unterminated string: the text ends inside it
+
+    if drop_commas:
+        cleaned = _remove_at(body, drop_commas)
+        try:
+            value = json.loads(cleaned)
+            report.update(method="trailing_commas", items=_first_list_len(value),
+                          chars_dropped=len(text) - len(cleaned))
+            return value, report
+        except ValueError:
+            pass
+
+    if cut is None:
+        return None, report
+    end, closers = cut
+    kept = _remove_at(body[:end], [i for i in drop_commas if i < end])
+    try:
+        value = json.loads(kept + closers)
+    except ValueError:
+        return None, report
+    report.update(method="truncated", items=_first_list_len(value), chars_dropped=len(text) - len(kept))
+    return value, report
+
+
+def _benchmark(n_tasks: int = 200, runs: int = 20) -> None:
+    """Time recover_json on a large, truncated, fenced orchestrator response."""
+    import time
+
+    tasks = [
+        {"date": f"2025-03-{1 + i % 28:02d}", "course": f"COURSE {i % 5}", "topic": f"Topic {i} — \"quoted\" [x]",
+         "task_type": ("learn", "practice", "review")[i % 3], "duration_hours": 1.5,
+         "resources": f"Ch {i % 12}.{i % 7} (pp. {10 * i}-{10 * i + 12})"}
+        for i in range(n_tasks)
+    ]
+    full = json.dumps({"tasks": tasks}, indent=2)
+    cases = {
+        "intact": full,
+        "fenced + commentary": f"Here is the plan:\n```json\n{full}\n```\nLet me know!",
+        "trailing comma": full.replace("\n  ]\n}", ",\n  ]\n}"),
+        "truncated at 90%": "```json\n" + full[: int(len(full) * 0.9)],
+    }
+    print(f"{n_tasks} tasks, {len(full) / 1024:.0f} KB")
+    for name, text in cases.items():
+        started = time.perf_counter()
+        for _ in range(runs):
+            value, report = recover_json(text)
+        ms = (time.perf_counter() - started) / runs * 1000
+        print(f"  {name:<22} {report['method']:<16} {report['items']:>4}/{n_tasks} items  {ms:7.2f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
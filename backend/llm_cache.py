@@ -0,0 +1,164 @@
+import copy
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# ---------------------------------------------------------------------------
+# Persistent LLM response cache (SQLite)
+# ---------------------------------------------------------------------------
+#
+# Keyed by (agent name, model, instruction hash, user message hash), so the
+# same syllabus uploaded by two students — or a re-run of /api/plan — is a
+# lookup instead of another rate-limited Gemini call. Entries expire after a
+# TTL; when the total cached size exceeds max_bytes the least recently used
+# entries are evicted.
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def cache_key(agent_name: str, model: str, instruction: str, message: str) -> str:
+    return _sha256("\x1f".join([agent_name, model, _sha256(instruction), _sha256(message)]))
+
+
+class ResponseCache:
+    def __init__(self, path: str, ttl_seconds: float, max_bytes: int):
+        self.path = path
+        self.ttl = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, agent TEXT, model TEXT,"
+            " created REAL, accessed REAL, size INTEGER, value TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT created, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            created, value = row
+            if now - created > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key: str, agent_name: str, model: str, value: Any) -> None:
+        payload = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, agent, model, created, accessed, size, value)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, agent_name, model, now, now, len(payload), payload),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then LRU entries until we're under max_bytes."""
+        cur = self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self.evicted += max(cur.rowcount, 0)
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY accessed ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evicted += 1
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            entries, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Singleflight — coalesce identical in-flight calls
+# ---------------------------------------------------------------------------
+#
+# When several sessions ask for the same (agent, prompt) at once, only the
+# first caller actually hits Gemini; the rest await the same task. The call is
+# cancelled only once every caller waiting on it has gone away.
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, Dict] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._calls.get(key)
+        if entry is None:
+            entry = {"task": asyncio.create_task(fn()), "waiters": 0}
+            self._calls[key] = entry
+            entry["task"].add_done_callback(lambda _t, k=key, e=entry: self._forget(k, e))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        entry["waiters"] += 1
+        try:
+            result = await asyncio.shield(entry["task"])
+        finally:
+            entry["waiters"] -= 1
+            if entry["waiters"] == 0 and not entry["task"].done():
+                # Forget it now, not in the done callback: a caller arriving
+                # before the cancel lands must start a fresh call, not join this one
+                self._forget(key, entry)
+                entry["task"].cancel()
+        # Every caller gets its own copy — downstream code mutates results in place
+        return copy.deepcopy(result)
+
+    def _forget(self, key: str, entry: Dict) -> None:
+        if self._calls.get(key) is entry:
+            del self._calls[key]
+
+    def metrics(self) -> Dict:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -2,7 +2,9 @@ import os
 import shutil
 import uuid
 import json
+import time
 import asyncio
+import hashlib
 from datetime import datetime
 from typing import List, Optional, Dict
 from dotenv import load_dotenv
@@ -10,11 +12,17 @@ from dotenv import load_dotenv
 # Load environment variables FIRST before other imports
 load_dotenv(dotenv_path="../.env.local")
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from agents import analyze_syllabus, analyze_exam_scope, analyze_textbook, generate_study_plan
+from pipeline import Degraded, Stage, StageGraph
+from checkpoints import SessionCheckpoints, course_fingerprint
+from scheduler import validate_and_repair
+from agents import extract_documents_text, analyze_syllabus, analyze_exam_scope, analyze_textbook, generate_study_plan, generate_sharded_plan, plan_locally, compress_courses, write_topic_notes, apply_notes, shutdown_pdf_pool, gemini_limiter, llm_cache, inflight_calls, retry_policy, response_validation
+from retry import RetryBudget, current_retry_budget
+from jobs import Job, JobQueue, QueueFull, QueueClosed
+from session_store import EvictionPolicy, open_store
 
 app = FastAPI(title="prep(x) API")
 
@@ -29,13 +37,82 @@ app.add_middleware(
 
 # Constants
 UPLOAD_DIR = "sessions"
+# Max courses analyzed in parallel within one plan request
+COURSE_CONCURRENCY = int(os.getenv("COURSE_CONCURRENCY", "3"))
+# Default scheduler: "llm" (ChiefOrchestrator) or "local" (zero-token greedy engine)
+PLAN_SCHEDULER = os.getenv("PLAN_SCHEDULER", "llm")
+# Split ChiefOrchestrator into per-course calls: "off", "course", or "auto"
+# (shard once a plan has SHARD_MIN_COURSES or more courses)
+PLAN_SHARDING = os.getenv("PLAN_SHARDING", "auto")
+SHARD_MIN_COURSES = int(os.getenv("SHARD_MIN_COURSES", "5"))
+# Notes for the local scheduler: "template" (zero-token) or "llm" (NotesWriter)
+LOCAL_PLAN_NOTES = os.getenv("LOCAL_PLAN_NOTES", "template")
+# Max LLM retries across one plan request
+SESSION_RETRY_BUDGET = int(os.getenv("SESSION_RETRY_BUDGET", "20"))
+# Plan workflows run on a fixed pool of workers; past JOB_QUEUE_DEPTH waiting
+# requests, /api/plan answers 429 instead of queueing more
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", "50"))
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# In-memory storage for logs and results
-session_logs: Dict[str, List[Dict]] = {}
-session_results: Dict[str, List] = {}
-# SSE event queues per session for real-time streaming
-session_queues: Dict[str, List[asyncio.Queue]] = {}
+# A running plan whose SSE clients have all been gone this long is cancelled
+# (0 = never auto-cancel)
+SSE_DISCONNECT_GRACE = float(os.getenv("SSE_DISCONNECT_GRACE", "120"))
+
+# Where job state, logs and results live: "memory" (this process only) or
+# "sqlite" (shared by every uvicorn worker, survives restarts)
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", os.path.join(UPLOAD_DIR, ".session_store.sqlite3"))
+# How often SSE streams check the store for events written by other workers
+STORE_POLL_INTERVAL = float(os.getenv("STORE_POLL_INTERVAL", "0.5"))
+# Each worker refreshes its jobs' records this often; a record not refreshed
+# for JOB_STALE_AFTER seconds belongs to a worker that died
+JOB_HEARTBEAT = float(os.getenv("JOB_HEARTBEAT", "2"))
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "30"))
+
+# Session eviction: a finished session is dropped SESSION_TTL seconds after its
+# result was written; past SESSION_MAX_ENTRIES sessions or SESSION_MAX_MB of
+# logs/results, the least recently active finished sessions go first (0 = no
+# limit). With SESSION_SPILL on, evicted results are kept on disk and /result
+# still returns them, until they're SESSION_SPILL_TTL seconds old or the spill
+# directory grows past SESSION_SPILL_MAX_MB.
+SESSION_TTL = float(os.getenv("SESSION_TTL", "21600"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "500"))
+SESSION_MAX_MB = float(os.getenv("SESSION_MAX_MB", "256"))
+SESSION_SPILL = os.getenv("SESSION_SPILL", "1") == "1"
+SESSION_SPILL_DIR = os.getenv("SESSION_SPILL_DIR", os.path.join(UPLOAD_DIR, ".evicted_results"))
+SESSION_SPILL_TTL = float(os.getenv("SESSION_SPILL_TTL", str(7 * 24 * 3600)))
+SESSION_SPILL_MAX_MB = float(os.getenv("SESSION_SPILL_MAX_MB", "512"))
+SESSION_EVICT_INTERVAL = float(os.getenv("SESSION_EVICT_INTERVAL", "60"))
+
+store = open_store(SESSION_STORE, SESSION_STORE_PATH, EvictionPolicy(
+    ttl_seconds=SESSION_TTL,
+    max_sessions=SESSION_MAX_ENTRIES,
+    max_bytes=int(SESSION_MAX_MB * 1024 * 1024),
+    spill_dir=SESSION_SPILL_DIR if SESSION_SPILL else None,
+    spill_ttl_seconds=SESSION_SPILL_TTL,
+    spill_max_bytes=int(SESSION_SPILL_MAX_MB * 1024 * 1024),
+))
+# Identifies this process in job records
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+def mirror_job(job: Job) -> None:
+    """Copy a local job's state into the store so any worker can report it."""
+    if job.state == "queued":
+        store.put_job(job.id, {
+            "run_id": job.run_id, "key": job.key, "owner": WORKER_ID, "state": job.state,
+            "enqueued_at": job.enqueued_at, "started_at": None, "finished_at": None,
+            "error": None, "cancel_requested": False,
+        })
+    else:
+        store.update_job(job.id, job.run_id, state=job.state, started_at=job.started_at,
+                         finished_at=job.finished_at, error=job.error)
+
+job_queue = JobQueue(workers=JOB_WORKERS, max_depth=JOB_QUEUE_DEPTH, on_change=mirror_job)
+
+# Woken whenever this process appends an event, so local SSE streams don't
+# wait out a poll interval; events from other workers arrive by polling
+event_appended = asyncio.Event()
 
 # Models
 class CourseUpdate(BaseModel):
@@ -54,11 +131,39 @@ class PlanRequest(BaseModel):
     sessionId: str
     courses: List[CourseUpdate]
     constraints: Constraints
+    scheduler: str = ""  # "llm" (ChiefOrchestrator) or "local"; empty = PLAN_SCHEDULER
+
+@app.on_event("startup")
+async def startup():
+    asyncio.create_task(job_heartbeat())
+    asyncio.create_task(evict_sessions())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await job_queue.shutdown()
+    await asyncio.to_thread(store.flush)  # queued SQLite writes
+    shutdown_pdf_pool()
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "api_key_configured": bool(os.getenv("GEMINI_API_KEY"))}
 
+@app.get("/api/metrics")
+async def get_metrics():
+    return {
+        "rate_limiter": gemini_limiter.metrics(),
+        "llm_cache": llm_cache.metrics(),
+        "inflight_calls": inflight_calls.metrics(),
+        "retry": retry_policy.metrics(),
+        "response_validation": response_validation,
+        "job_queue": job_queue.metrics(),
+        "session_store": {"backend": SESSION_STORE, "worker": WORKER_ID, **(await store_io(store.metrics))},
+    }
+
+@app.get("/api/pipeline")
+async def get_pipeline():
+    return COURSE_GRAPH.describe()
+
 @app.post("/api/upload")
 async def upload_file(
     sessionId: str = Form(...),
@@ -81,61 +186,262 @@ async def upload_file(
         "status": "complete"
     }
 
-@app.post("/api/plan")
-async def generate_plan(request: PlanRequest):
+def submission_key(request: PlanRequest) -> str:
+    """Hash of the request body plus the uploaded files it covers.
+
+    Re-uploading a PDF changes the key even though the body is identical.
+    """
+    h = hashlib.sha256(json.dumps(request.dict(), sort_keys=True).encode("utf-8"))
+    for course in request.courses:
+        h.update(course_fingerprint(course.dict(), list_course_uploads(request.sessionId, course)).encode("utf-8"))
+    return h.hexdigest()
+
+# Serializes the check-then-submit in enqueue_workflow so two identical
+# requests arriving together can't both start a job
+submit_lock = asyncio.Lock()
+
+async def store_io(fn, *args, **kwargs):
+    """Call a store read. The SQLite store's run in a thread so a slow disk
+    can't stall the event loop (its writes are already queued to a writer
+    thread); the memory store isn't thread-safe, so it's called inline."""
+    if store.shared:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+async def job_info(sessionId: str) -> Optional[dict]:
+    """The session's current job: live state if it runs in this worker,
+    otherwise its record in the store (as written by whichever worker has it)."""
+    record = await store_io(store.get_job, sessionId)
+    job = job_queue.get(sessionId)  # after the await: it may have changed meanwhile
+    if job is not None and (record is None or record.get("run_id") == job.run_id):
+        info = job_queue.status(sessionId)
+        info.update(run_id=job.run_id, key=job.key, owner=WORKER_ID)
+        return info
+    if record is None:
+        return None
+    info = {
+        "state": record["state"],
+        "position": None,
+        "queued_at": record["enqueued_at"],
+        "started_at": record["started_at"],
+        "finished_at": record["finished_at"],
+        "eta_seconds": None,
+        "run_id": record["run_id"],
+        "key": record["key"],
+        "owner": record["owner"],
+    }
+    if info["state"] in ("queued", "running") and time.time() - record["updated"] > JOB_STALE_AFTER:
+        # The worker that had it stopped heartbeating — it crashed or restarted
+        info["state"] = "failed"
+        info["error"] = "The worker running this plan stopped responding"
+    elif record.get("error"):
+        info["error"] = record["error"]
+    return info
+
+def public_status(info: dict) -> dict:
+    return {k: v for k, v in info.items() if k not in ("run_id", "key")}
+
+async def enqueue_workflow(request: PlanRequest, resume: bool = False) -> dict:
+    """Queue a workflow run, or raise 429 (queue full) / 503 (shutting down).
+
+    Submissions are idempotent per session: the same body (and files) as the
+    session's queued, running or finished job returns that job unchanged; a
+    different body cancels the old job and replaces it.
+    """
+    sessionId = request.sessionId
+    key = await asyncio.to_thread(submission_key, request)
+    async with submit_lock:
+        existing = await job_info(sessionId)
+        if existing is not None and existing["key"] == key and existing["state"] in ("queued", "running", "done"):
+            status = public_status(existing)
+            status["duplicate"] = True
+            return status
+        superseded = existing is not None and existing["state"] in ("queued", "running")
+        if superseded and existing["owner"] == WORKER_ID:
+            await job_queue.cancel(sessionId)
+        # A job on another worker sees its record replaced on its next
+        # heartbeat and stops itself
+        status = await submit_job(request, key, resume)
+
+    if superseded:
+        add_log(sessionId, "System", "Previous plan request cancelled — replaced by this one.", "loading")
+    if status["state"] == "queued":
+        add_log(sessionId, "System", f"Queued at position {status['position']} (ETA ~{status['eta_seconds']}s).", "loading")
+    return status
+
+async def submit_job(request: PlanRequest, key: str, resume: bool) -> dict:
     sessionId = request.sessionId
-    session_logs[sessionId] = []
-    session_queues[sessionId] = []
+    try:
+        await job_queue.submit(sessionId, lambda: run_agent_workflow(request, resume=resume), key=key)
+    except QueueFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "message": "Too many plans in progress — try again shortly.",
+                "queue_depth": e.depth,
+                "retry_after_s": round(e.retry_after),
+            },
+            headers={"Retry-After": str(max(1, round(e.retry_after)))},
+        )
+    except QueueClosed:
+        raise HTTPException(status_code=503, detail="Server is shutting down")
 
-    # Run agentic workflow in background
-    asyncio.create_task(run_agent_workflow(request))
+    store.clear_events(sessionId)
+    store.delete_result(sessionId)  # so /result shows this run's partial plan
+    store.clear_partials(sessionId)
+    return public_status(await job_info(sessionId))
 
-    return {"message": "Plan generation started", "sessionId": sessionId}
+@app.post("/api/plan")
+async def generate_plan(request: PlanRequest):
+    status = await enqueue_workflow(request)
+    message = "Plan generation already submitted" if status.get("duplicate") else "Plan generation started"
+    return {"message": message, "sessionId": request.sessionId, "queue": status}
+
+@app.post("/api/plan/{sessionId}/resume")
+async def resume_plan(sessionId: str):
+    """Restart the workflow from the last completed stage of a previous run."""
+    saved = SessionCheckpoints(UPLOAD_DIR, sessionId).load_request()
+    if saved is None:
+        raise HTTPException(status_code=404, detail="No checkpoint for this session")
+    request = PlanRequest(**saved)
+    status = await enqueue_workflow(request, resume=True)
+
+    return {"message": "Plan generation resumed", "sessionId": sessionId, "queue": status}
+
+@app.delete("/api/plan/{sessionId}")
+async def cancel_plan(sessionId: str):
+    """Stop a queued or running plan and everything it has in flight."""
+    if not await cancel_workflow(sessionId, "Plan cancelled."):
+        raise HTTPException(status_code=404, detail="No plan in progress for this session")
+    return {"message": "Plan generation cancelled", "sessionId": sessionId}
+
+async def cancel_workflow(sessionId: str, reason: str) -> bool:
+    """Cancel the session's job and tell its clients. False if nothing was running."""
+    async with submit_lock:
+        info = await job_info(sessionId)
+        if info is None or info["state"] not in ("queued", "running"):
+            return False
+        if info["owner"] != WORKER_ID:
+            # Another worker has it; it cancels on its next heartbeat
+            store.update_job(sessionId, info["run_id"], cancel_requested=reason)
+            return True
+        # Cancellation propagates down through the course tasks, the stage
+        # graph, retries and rate-limiter waits into the in-flight Gemini call
+        await job_queue.cancel(sessionId)
+    store.clear_partials(sessionId)
+    store.set_result(sessionId, {"status": "cancelled", "message": reason})
+    add_log(sessionId, "System", reason, "error")
+    broadcast_log(sessionId, {
+        "_done": True,
+        "agent": "System",
+        "message": reason,
+        "timestamp": datetime.now().strftime("%I:%M:%S %p"),
+        "status": "error"
+    })
+    return True
+
+async def job_heartbeat() -> None:
+    """Keep this worker's job records fresh and act on what other workers asked."""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT)
+        for job in job_queue.active_jobs():
+            try:
+                await check_job(job)
+            except Exception as e:
+                print(f"[System] Heartbeat for {job.id} failed: {e}")
+
+async def evict_sessions() -> None:
+    """Periodically drop finished sessions from the store (see SESSION_TTL)."""
+    while True:
+        await asyncio.sleep(SESSION_EVICT_INTERVAL)
+        try:
+            evicted = await store_io(store.evict, JOB_STALE_AFTER)
+        except Exception as e:
+            print(f"[System] Session eviction failed: {e}")
+            continue
+        for sessionId in evicted:
+            job_queue.forget(sessionId)
+        # Finished jobs whose record another worker evicted
+        for job in job_queue.finished_jobs():
+            if await store_io(store.get_job, job.id) is None:
+                job_queue.forget(job.id)
+        if evicted:
+            ttl = sum(1 for reason in evicted.values() if reason == "ttl")
+            print(f"[System] Evicted {len(evicted)} session(s) ({ttl} expired, {len(evicted) - ttl} over cap)")
+
+async def check_job(job: Job) -> None:
+    record = await store_io(store.get_job, job.id)
+    if record is None or record.get("run_id") != job.run_id:
+        # Superseded by a submission that another worker accepted
+        print(f"[System] Job for {job.id} superseded elsewhere — stopping")
+        await job_queue.cancel(job.id)
+        return
+    store.update_job(job.id, job.run_id)  # heartbeat
+    if record.get("cancel_requested"):
+        await cancel_workflow(job.id, record["cancel_requested"])
+        return
+    # Every SSE client gone for longer than the grace period: nobody's watching.
+    # Clients count from when the job was enqueued (one may have come and gone
+    # while it waited in line); earlier ones were watching a previous run.
+    seen = await store_io(store.last_client_seen, job.id)
+    if (SSE_DISCONNECT_GRACE > 0 and job.state == "running" and seen is not None
+            and seen >= job.enqueued_at and time.time() - seen > SSE_DISCONNECT_GRACE):
+        await cancel_workflow(job.id, f"Plan cancelled — no client connected for {SSE_DISCONNECT_GRACE:.0f}s.")
+
+@app.get("/api/plan/{sessionId}/status")
+async def get_status(sessionId: str):
+    """Queue position and ETA for the session's plan job."""
+    info = await job_info(sessionId)
+    if info is None:
+        raise HTTPException(status_code=404, detail="No plan job for this session")
+    return public_status(info)
 
 @app.get("/api/plan/{sessionId}/logs")
 async def get_logs(sessionId: str):
-    return session_logs.get(sessionId, [])
+    events = await store_io(store.events_after, sessionId)
+    return [entry for _, kind, entry in events if kind == "log"]
 
 @app.get("/api/plan/{sessionId}/result")
 async def get_result(sessionId: str):
-    if sessionId in session_results:
-        return session_results[sessionId]
+    result = await store_io(store.get_result, sessionId)
+    if result is not None:
+        return result
+    partial = await store_io(store.get_partials, sessionId)
+    if partial:
+        return {"status": "processing", "partial": sorted(partial, key=lambda t: str(t.get("date", "")))}
     return {"status": "processing"}
 
 @app.get("/api/plan/{sessionId}/stream")
-async def stream_logs(sessionId: str):
-    """SSE endpoint for real-time agent log streaming."""
-    queue: asyncio.Queue = asyncio.Queue()
-
-    # Register this client's queue
-    if sessionId not in session_queues:
-        session_queues[sessionId] = []
-    session_queues[sessionId].append(queue)
-
-    # Send any existing logs first (catchup)
-    existing_logs = session_logs.get(sessionId, [])
-    for log in existing_logs:
-        await queue.put(log)
+async def stream_logs(sessionId: str, request: Request):
+    """SSE endpoint for real-time agent log streaming.
 
+    Replays the session's events so far, then follows the store for new ones,
+    so it works whichever worker is running the plan.
+    """
     async def event_generator():
-        try:
-            while True:
-                try:
-                    log = await asyncio.wait_for(queue.get(), timeout=30.0)
-                    # Check for completion signal
-                    if log.get("_done"):
-                        data = json.dumps(log)
-                        yield f"data: {data}\n\n"
-                        break
-                    data = json.dumps(log)
-                    yield f"data: {data}\n\n"
-                except asyncio.TimeoutError:
-                    # Send keepalive
-                    yield f": keepalive\n\n"
-        finally:
-            # Cleanup queue on disconnect
-            if sessionId in session_queues and queue in session_queues[sessionId]:
-                session_queues[sessionId].remove(queue)
+        last_seq = 0
+        last_sent = last_touch = 0.0
+        while not await request.is_disconnected():
+            now = time.monotonic()
+            if now - last_touch >= JOB_HEARTBEAT:
+                store.touch_client(sessionId)  # tells the job owner someone is watching
+                last_touch = now
+            wakeup = event_appended
+            for seq, kind, entry in await store_io(store.events_after, sessionId, last_seq):
+                last_seq = seq
+                last_sent = now
+                yield f"data: {json.dumps(entry)}\n\n"
+                # Check for completion signal
+                if kind == "done":
+                    return
+            if now - last_sent >= 30.0:
+                # Send keepalive
+                yield f": keepalive\n\n"
+                last_sent = now
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=STORE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
 
     return StreamingResponse(
         event_generator(),
@@ -147,8 +453,197 @@ async def stream_logs(sessionId: str):
         }
     )
 
-async def run_agent_workflow(request: PlanRequest):
+def list_uploads(sessionId: str, course: CourseUpdate, docType: str) -> List[str]:
+    doc_dir = os.path.join(UPLOAD_DIR, sessionId, course.id, docType)
+    return [os.path.join(doc_dir, f) for f in os.listdir(doc_dir)] if os.path.exists(doc_dir) else []
+
+def list_course_uploads(sessionId: str, course: CourseUpdate) -> Dict[str, List[str]]:
+    return {doc_type: list_uploads(sessionId, course, doc_type)
+            for doc_type in ("syllabus", "midterm_overview", "textbook")}
+
+# ---------------------------------------------------------------------------
+# Per-course stage graph
+#
+#   syllabus_text ─► syllabus (lazy) ┐
+#                                    ├─► topics ─► textbook
+#   scope ───────────────────────────┘
+#
+# SyllabusExpert and ExamScopeAnalyst don't depend on each other, so they run
+# concurrently; the topic resolution (exam date + syllabus fallback) joins them.
+# The syllabus is only needed when the exam overview has no topics or no exam
+# date, so with LAZY_SYLLABUS=1 (default) its LLM call runs on demand — the PDF
+# text is still extracted eagerly so it's ready if we do need it.
+# ---------------------------------------------------------------------------
+
+LAZY_SYLLABUS = os.getenv("LAZY_SYLLABUS", "1") == "1"
+
+async def syllabus_text_stage(syllabus_files: List[str]) -> str:
+    return await extract_documents_text(syllabus_files) if syllabus_files else ""
+
+async def syllabus_stage(session_id: str, course: CourseUpdate, syllabus_files: List[str], syllabus_text: str) -> dict:
+    add_log(session_id, "SyllabusExpert", f"Analyzing syllabus for {course.code}...", "loading")
+    if not syllabus_files:
+        return {"course_name": course.name}
+    syllabus_info, ok = await analyze_syllabus(syllabus_files, syllabus_text)
+    if not ok:
+        add_log(session_id, "SyllabusExpert", f"Syllabus analysis failed for {course.code} — continuing without it.", "error")
+        return Degraded(syllabus_info)
+    modules = syllabus_info.get('modules', [])
+    add_log(session_id, "SyllabusExpert", f"Syllabus extracted for {course.code} — {len(modules)} modules identified.", "success")
+    return syllabus_info
+
+async def scope_stage(session_id: str, course: CourseUpdate, overview_files: List[str]) -> dict:
+    add_log(session_id, "ExamScopeAnalyst", f"Analyzing midterm overview for {course.code}...", "loading")
+    if not overview_files:
+        return {"topics": []}
+    scope_info, ok = await analyze_exam_scope(overview_files)
+    if not ok:
+        add_log(session_id, "ExamScopeAnalyst", f"Midterm overview analysis failed for {course.code} — it will be retried on the next plan.", "error")
+        return Degraded(scope_info)
+    return scope_info
+
+def exam_date_from_assessments(assessments: List) -> str:
+    """Pick the midterm (or failing that, any exam/test) date listed in the syllabus."""
+    dated = []
+    for a in assessments:
+        if not isinstance(a, dict):
+            continue
+        try:
+            datetime.strptime(str(a.get("date", "")), "%Y-%m-%d")
+        except ValueError:
+            continue
+        dated.append((str(a.get("type", "")).lower(), a["date"]))
+    for keywords in (("midterm",), ("exam", "test")):
+        for kind, date in dated:
+            if any(k in kind for k in keywords):
+                return date
+    return ""
+
+async def topics_stage(session_id: str, course: CourseUpdate, scope_info: dict, syllabus_info) -> dict:
+    topics = scope_info.get("topics", [])
+    topics_count = len(topics)
+
+    # Extract exam date from midterm overview (auto-detect)
+    extracted_exam_date = scope_info.get("exam_date", "")
+    if extracted_exam_date and extracted_exam_date.lower() in ("unknown", "n/a", "none", ""):
+        extracted_exam_date = ""
+
+    # The syllabus is only consulted when the overview leaves a gap
+    if topics_count == 0 or not (course.examDate or extracted_exam_date):
+        syllabus = await syllabus_info()
+    else:
+        syllabus = {}
+        add_log(session_id, "SyllabusExpert", f"Skipped for {course.code} — midterm overview already gives topics and exam date.", "success")
+    modules = syllabus.get('modules', [])
+
+    date_source = " (manual override)"
+    resolved_exam_date = course.examDate
+    if not resolved_exam_date:
+        resolved_exam_date = extracted_exam_date
+        date_source = " (from midterm overview)"
+    if not resolved_exam_date:
+        resolved_exam_date = exam_date_from_assessments(syllabus.get("assessments", []))
+        date_source = " (from syllabus)"
+    if resolved_exam_date:
+        add_log(session_id, "ExamScopeAnalyst",
+            f"Exam date for {course.code}: {resolved_exam_date}" + date_source,
+            "success")
+
+    # Fallback: if scope returned 0 topics, use syllabus modules as topics
+    if topics_count == 0 and modules:
+        add_log(session_id, "ExamScopeAnalyst", f"No topics from midterm overview — falling back to {len(modules)} syllabus modules as topics.", "loading")
+        fallback_topics = []
+        for m in modules:
+            if isinstance(m, dict):
+                for t in m.get("topics", []):
+                    fallback_topics.append({"name": t, "importance": "medium"})
+                if not m.get("topics") and m.get("name"):
+                    fallback_topics.append({"name": m["name"], "importance": "medium"})
+        if fallback_topics:
+            scope_info["topics"] = fallback_topics
+            topics = fallback_topics
+            topics_count = len(topics)
+            add_log(session_id, "ExamScopeAnalyst", f"Fallback: {topics_count} topics derived from syllabus modules.", "success")
+
+    # Show topic names in the log
+    topic_names = [t.get("name", t) if isinstance(t, dict) else t for t in topics[:4]]
+    topic_preview = ", ".join(topic_names)
+    if topics_count > 4:
+        topic_preview += f" (+{topics_count - 4} more)"
+    add_log(session_id, "ExamScopeAnalyst", f"Exam scope for {course.code}: {topics_count} topics — {topic_preview}", "success")
+
+    return {"scope": scope_info, "exam_date": resolved_exam_date}
+
+async def textbook_stage(session_id: str, course: CourseUpdate, scope: dict, textbook_files: List[str]) -> list:
+    # Two-pass: TocNavigator → StudyGuideGuru (ADK agents with tools)
+    add_log(session_id, "TocNavigator", f"Scanning textbook TOC for {course.code} to find relevant chapters...", "loading")
+    if textbook_files:
+        guide_info, ok = await analyze_textbook(textbook_files, scope.get("topics", []))
+        if not ok:
+            add_log(session_id, "TocNavigator", f"Textbook mapping failed for {course.code} — using placeholder resources.", "error")
+            return Degraded(guide_info)
+        add_log(session_id, "TocNavigator", f"TOC scan complete for {course.code}.", "success")
+    else:
+        guide_info = []
+        add_log(session_id, "TocNavigator", f"No textbook uploaded for {course.code} — skipping.", "success")
+
+    guide_count = len(guide_info) if isinstance(guide_info, list) else 0
+    total_hours = 0
+    if isinstance(guide_info, list):
+        for g in guide_info:
+            if isinstance(g, dict):
+                total_hours += g.get("estimated_hours", 0)
+    add_log(session_id, "StudyGuideGuru", f"Resource mapping for {course.code}: {guide_count} topics mapped, ~{total_hours:.1f}h estimated.", "success")
+    return guide_info
+
+COURSE_GRAPH = StageGraph(
+    stages=[
+        Stage("syllabus_text", syllabus_text_stage, ["syllabus_files"], ["syllabus_text"], checkpoint=False),
+        Stage("syllabus", syllabus_stage, ["session_id", "course", "syllabus_files", "syllabus_text"], ["syllabus_info"],
+              lazy=LAZY_SYLLABUS),
+        Stage("scope", scope_stage, ["session_id", "course", "overview_files"], ["scope_info"]),
+        Stage("topics", topics_stage, ["session_id", "course", "scope_info"], ["scope", "exam_date"],
+              lazy_inputs=["syllabus_info"]),
+        Stage("textbook", textbook_stage, ["session_id", "course", "scope", "textbook_files"], ["guide"]),
+    ],
+    initial=["session_id", "course", "syllabus_files", "overview_files", "textbook_files"],
+)
+
+async def analyze_course(sessionId: str, course: CourseUpdate, checkpoints: SessionCheckpoints) -> dict:
+    """Run the per-course stage graph for one course, restoring checkpointed stages."""
+    uploads = list_course_uploads(sessionId, course)
+    course_checkpoint = checkpoints.course(course.id)
+    # Drops this course's saved stages if its files or fields changed since they ran
+    course_checkpoint.validate(await asyncio.to_thread(course_fingerprint, course.dict(), uploads))
+
+    values = await COURSE_GRAPH.run({
+        "session_id": sessionId,
+        "course": course,
+        "syllabus_files": uploads["syllabus"],
+        "overview_files": uploads["midterm_overview"],
+        "textbook_files": uploads["textbook"],
+    }, checkpoint=course_checkpoint)
+    if course_checkpoint.restored:
+        add_log(sessionId, "System", f"Reused saved analysis for {course.code} — {', '.join(course_checkpoint.restored)} unchanged.", "success")
+
+    course_dict = course.dict()
+    course_dict["examDate"] = values["exam_date"]
+
+    return {
+        "course": course_dict,
+        "syllabus": values.get("syllabus_info", {}),
+        "scope": values["scope"],
+        "guide": values["guide"]
+    }
+
+async def run_agent_workflow(request: PlanRequest, resume: bool = False):
     sessionId = request.sessionId
+    checkpoints = SessionCheckpoints(UPLOAD_DIR, sessionId)
+    if not resume:
+        # New request: course analysis is reused where uploads are unchanged,
+        # but the schedule always has to be rebuilt for the new constraints
+        checkpoints.clear_plan()
+    checkpoints.save_request(request.dict())
 
     # Build course color map from frontend data
     COURSE_COLORS = ['#4a5d45', '#8c7851', '#51688c', '#8c5151', '#518c86']
@@ -156,113 +651,122 @@ async def run_agent_workflow(request: PlanRequest):
     for i, course in enumerate(request.courses):
         course_color_map[course.code] = COURSE_COLORS[i % len(COURSE_COLORS)]
 
-    all_course_data = []
     total_courses = len(request.courses)
+    # Shared by every LLM call in this session (course tasks inherit the context)
+    current_retry_budget.set(RetryBudget(SESSION_RETRY_BUDGET))
 
     try:
-        for idx, course in enumerate(request.courses):
-            course_num = idx + 1
-            course_dir_key = course.id
-
-            # 1. Syllabus analysis (ADK agent)
-            add_log(sessionId, "SyllabusExpert", f"Analyzing syllabus for {course.code}...", "loading")
-            syllabus_dir = os.path.join(UPLOAD_DIR, sessionId, course_dir_key, "syllabus")
-            syllabus_files = [os.path.join(syllabus_dir, f) for f in os.listdir(syllabus_dir)] if os.path.exists(syllabus_dir) else []
-
-            syllabus_info = await analyze_syllabus(syllabus_files) if syllabus_files else {"course_name": course.name}
-            modules = syllabus_info.get('modules', [])
-            add_log(sessionId, "SyllabusExpert", f"Syllabus extracted for {course.code} — {len(modules)} modules identified.", "success")
-
-            # 2. Exam scope analysis (ADK agent)
-            add_log(sessionId, "ExamScopeAnalyst", f"Analyzing midterm overview for {course.code}...", "loading")
-            overview_dir = os.path.join(UPLOAD_DIR, sessionId, course_dir_key, "midterm_overview")
-            overview_files = [os.path.join(overview_dir, f) for f in os.listdir(overview_dir)] if os.path.exists(overview_dir) else []
-
-            scope_info = await analyze_exam_scope(overview_files) if overview_files else {"topics": []}
-            topics = scope_info.get("topics", [])
-            topics_count = len(topics)
-
-            # Extract exam date from midterm overview (auto-detect)
-            extracted_exam_date = scope_info.get("exam_date", "")
-            if extracted_exam_date and extracted_exam_date.lower() in ("unknown", "n/a", "none", ""):
-                extracted_exam_date = ""
-            resolved_exam_date = course.examDate if course.examDate else extracted_exam_date
-            if resolved_exam_date:
-                add_log(sessionId, "ExamScopeAnalyst",
-                    f"Exam date for {course.code}: {resolved_exam_date}" +
-                    (" (from midterm overview)" if not course.examDate else " (manual override)"),
-                    "success")
-
-            # Fallback: if scope returned 0 topics, use syllabus modules as topics
-            if topics_count == 0 and modules:
-                add_log(sessionId, "ExamScopeAnalyst", f"No topics from midterm overview — falling back to {len(modules)} syllabus modules as topics.", "loading")
-                fallback_topics = []
-                for m in modules:
-                    if isinstance(m, dict):
-                        for t in m.get("topics", []):
-                            fallback_topics.append({"name": t, "importance": "medium"})
-                        if not m.get("topics") and m.get("name"):
-                            fallback_topics.append({"name": m["name"], "importance": "medium"})
-                if fallback_topics:
-                    scope_info["topics"] = fallback_topics
-                    topics = fallback_topics
-                    topics_count = len(topics)
-                    add_log(sessionId, "ExamScopeAnalyst", f"Fallback: {topics_count} topics derived from syllabus modules.", "success")
-
-            # Show topic names in the log
-            topic_names = [t.get("name", t) if isinstance(t, dict) else t for t in topics[:4]]
-            topic_preview = ", ".join(topic_names)
-            if topics_count > 4:
-                topic_preview += f" (+{topics_count - 4} more)"
-            add_log(sessionId, "ExamScopeAnalyst", f"Exam scope for {course.code}: {topics_count} topics — {topic_preview}", "success")
-
-            # 3. Textbook analysis — two-pass: TocNavigator → StudyGuideGuru (ADK agents with tools)
-            add_log(sessionId, "TocNavigator", f"Scanning textbook TOC for {course.code} to find relevant chapters...", "loading")
-            textbook_dir = os.path.join(UPLOAD_DIR, sessionId, course_dir_key, "textbook")
-            textbook_files = [os.path.join(textbook_dir, f) for f in os.listdir(textbook_dir)] if os.path.exists(textbook_dir) else []
-
-            if textbook_files:
-                guide_info = await analyze_textbook(textbook_files, scope_info.get("topics", []))
-                add_log(sessionId, "TocNavigator", f"TOC scan complete for {course.code}.", "success")
-            else:
-                guide_info = []
-                add_log(sessionId, "TocNavigator", f"No textbook uploaded for {course.code} — skipping.", "success")
-
-            guide_count = len(guide_info) if isinstance(guide_info, list) else 0
-            total_hours = 0
-            if isinstance(guide_info, list):
-                for g in guide_info:
-                    if isinstance(g, dict):
-                        total_hours += g.get("estimated_hours", 0)
-            add_log(sessionId, "StudyGuideGuru", f"Resource mapping for {course.code}: {guide_count} topics mapped, ~{total_hours:.1f}h estimated.", "success")
-
-            add_log(sessionId, "System", f"Course {course_num}/{total_courses} fully analyzed: {course.code}", "success")
-
-            course_dict = course.dict()
-            course_dict["examDate"] = resolved_exam_date
-
-            all_course_data.append({
-                "course": course_dict,
-                "syllabus": syllabus_info,
-                "scope": scope_info,
-                "guide": guide_info
-            })
+        # Courses are independent, so analyze up to COURSE_CONCURRENCY at once.
+        # Every LLM call still goes through the shared FIFO rate limiter, so this
+        # only fills idle rate-limit slots — it never exceeds RPM/TPM.
+        course_slots = asyncio.Semaphore(COURSE_CONCURRENCY)
+        completed = 0
+
+        async def run_course(course: CourseUpdate) -> dict:
+            nonlocal completed
+            async with course_slots:
+                course_data = await analyze_course(sessionId, course, checkpoints)
+            completed += 1
+            add_log(sessionId, "System", f"Course {completed}/{total_courses} fully analyzed: {course.code}", "success")
+            return course_data
+
+        course_tasks = [asyncio.create_task(run_course(c)) for c in request.courses]
+        try:
+            # gather() keeps results in request order regardless of finish order
+            all_course_data = list(await asyncio.gather(*course_tasks))
+        except BaseException:
+            for t in course_tasks:
+                t.cancel()
+            raise
 
         # Final orchestration (ADK agent)
         total_est = sum(
             sum(g.get("estimated_hours", 0) for g in cd.get("guide", []) if isinstance(g, dict))
             for cd in all_course_data
         )
-        add_log(sessionId, "ChiefOrchestrator", f"Synthesizing schedule across {total_courses} courses (~{total_est:.0f}h of content)...", "loading")
-        final_plan = await generate_study_plan(all_course_data, request.constraints.dict())
-
-        # Inject courseColor into each task
-        if isinstance(final_plan, list):
-            for task in final_plan:
-                if isinstance(task, dict) and "courseColor" not in task:
-                    task["courseColor"] = course_color_map.get(task.get("course", ""), "#4a5d45")
+        final_plan = checkpoints.load_plan() if resume else None
+        if final_plan is not None:
+            add_log(sessionId, "ChiefOrchestrator", "Resumed finished plan from checkpoint.", "success")
+            compressed = compress_courses(all_course_data)
+            notes_task = None
+            if isinstance(final_plan, list) and any(isinstance(t, dict) and not t.get("notes") for t in final_plan):
+                # Saved before its notes were written (cancelled or restarted
+                # meanwhile) — finished batches come back from the response cache
+                notes_task = asyncio.create_task(write_topic_notes(compressed))
+        else:
+            compressed = compress_courses(all_course_data)
+            if (request.scheduler or PLAN_SCHEDULER) == "local":
+                add_log(sessionId, "ChiefOrchestrator", f"Scheduling {total_courses} courses locally (~{total_est:.0f}h of content)...", "loading")
+                local = plan_locally(all_course_data, request.constraints.dict())
+                final_plan = local["tasks"]
+                for d in local["dropped"]:
+                    add_log(sessionId, "ChiefOrchestrator", f"Dropped {d['course']} — {d['topic']} ({d['importance']}): not enough time before the exam.", "loading")
+                notes_task = asyncio.create_task(write_topic_notes(compressed)) if LOCAL_PLAN_NOTES == "llm" else None
+            else:
+                add_log(sessionId, "ChiefOrchestrator", f"Synthesizing schedule across {total_courses} courses (~{total_est:.0f}h of content)...", "loading")
+                # Notes only depend on the topics, so write them while the schedule is generated
+                notes_task = asyncio.create_task(write_topic_notes(compressed))
+                store.clear_partials(sessionId)
+
+                def on_task(key, task):
+                    if not isinstance(task, dict):
+                        return
+                    task.setdefault("courseColor", course_color_map.get(task.get("course", ""), "#4a5d45"))
+                    store.set_partial(sessionId, str(key), task)
+                    broadcast_log(sessionId, {
+                        "type": "task",
+                        "agent": "ChiefOrchestrator",
+                        "message": f"Scheduled {task.get('course', '')} — {task.get('topic', '')} on {task.get('date', '?')}",
+                        "task": task,
+                        "timestamp": datetime.now().strftime("%I:%M:%S %p"),
+                        "status": "loading",
+                    })
 
-        session_results[sessionId] = final_plan
+                try:
+                    if PLAN_SHARDING == "course" or (PLAN_SHARDING == "auto" and total_courses >= SHARD_MIN_COURSES):
+                        add_log(sessionId, "ChiefOrchestrator", f"Large plan — generating {total_courses} per-course shards in parallel.", "loading")
+                        final_plan = await generate_sharded_plan(all_course_data, request.constraints.dict(), on_task)
+                    else:
+                        final_plan = await generate_study_plan(all_course_data, request.constraints.dict(), on_task)
+                except BaseException:
+                    notes_task.cancel()
+                    raise
+
+                # Check the LLM's plan against the constraints and fix violations locally
+                repair = validate_and_repair(final_plan if isinstance(final_plan, list) else [],
+                                             compressed, request.constraints.dict())
+                final_plan = repair["tasks"]
+                if repair["changes"]:
+                    counts = {}
+                    for change in repair["changes"]:
+                        counts[change["action"]] = counts.get(change["action"], 0) + 1
+                        print(f"  [Validator] {change}")
+                    summary = ", ".join(f"{n} {action}" for action, n in counts.items())
+                    add_log(sessionId, "System", f"Validator repaired {len(repair['changes'])} schedule violations ({summary}).", "success")
+
+            # Inject courseColor into each task
+            if isinstance(final_plan, list):
+                for task in final_plan:
+                    if isinstance(task, dict) and "courseColor" not in task:
+                        task["courseColor"] = course_color_map.get(task.get("course", ""), "#4a5d45")
+            # Checkpoint the schedule before notes, so a notes failure or a
+            # cancel while waiting on them never costs a resume the orchestrator call
+            checkpoints.save_plan(final_plan)
+
+        if notes_task is not None:
+            add_log(sessionId, "NotesWriter", f"Writing study notes for {sum(len(c['topics']) for c in compressed)} topics...", "loading")
+            try:
+                notes = await notes_task
+            except Exception as e:
+                notes = {}
+                add_log(sessionId, "NotesWriter", f"Study notes failed ({e}) — keeping default notes.", "error")
+            apply_notes(final_plan, notes)
+            if notes:
+                add_log(sessionId, "NotesWriter", f"Study notes ready for {len(notes)} topics.", "success")
+            checkpoints.save_plan(final_plan)
+
+        store.set_result(sessionId, final_plan)
+        store.clear_partials(sessionId)
         task_count = len(final_plan) if isinstance(final_plan, list) else 0
         add_log(sessionId, "ChiefOrchestrator", f"Plan complete — {task_count} study sessions scheduled across {len(set(t.get('date','') for t in final_plan if isinstance(t,dict)))} days.", "success")
 
@@ -275,13 +779,18 @@ async def run_agent_workflow(request: PlanRequest):
             "status": "success"
         })
 
+    except asyncio.CancelledError:
+        print(f"[System] Workflow for {sessionId} cancelled")
+        raise
+
     except Exception as e:
         error_msg = str(e)
         print(f"[ERROR] Agent workflow failed: {error_msg}")
         import traceback
         traceback.print_exc()
         add_log(sessionId, "System", f"Error: {error_msg}", "error")
-        session_results[sessionId] = {"error": error_msg}
+        store.set_result(sessionId, {"error": error_msg})
+        store.clear_partials(sessionId)
         broadcast_log(sessionId, {
             "_done": True,
             "agent": "System",
@@ -289,27 +798,29 @@ async def run_agent_workflow(request: PlanRequest):
             "timestamp": datetime.now().strftime("%I:%M:%S %p"),
             "status": "error"
         })
+        raise  # marks the job failed, so resubmitting the same request runs it again
 
 def add_log(sessionId: str, agent: str, message: str, status: str):
-    if sessionId not in session_logs:
-        session_logs[sessionId] = []
     log_entry = {
         "agent": agent,
         "message": message,
         "timestamp": datetime.now().strftime("%I:%M:%S %p"),
         "status": status
     }
-    session_logs[sessionId].append(log_entry)
-    broadcast_log(sessionId, log_entry)
+    store.append_event(sessionId, "log", log_entry)
+    notify_streams()
 
 def broadcast_log(sessionId: str, log_entry: dict):
-    """Push log to all SSE clients listening on this session."""
-    if sessionId in session_queues:
-        for queue in session_queues[sessionId]:
-            try:
-                queue.put_nowait(log_entry)
-            except asyncio.QueueFull:
-                pass
+    """Push an event (streamed task, done signal) to every SSE client of this session."""
+    kind = "done" if log_entry.get("_done") else log_entry.get("type", "log")
+    store.append_event(sessionId, kind, log_entry)
+    notify_streams()
+
+def notify_streams():
+    """Wake this process's SSE streams to check the store now."""
+    global event_appended
+    event_appended.set()
+    event_appended = asyncio.Event()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,242 @@
+import os
+import json
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PyPDF2 import PdfReader
+
+# ---------------------------------------------------------------------------
+# Content-addressed page cache — parse each PDF once, keyed by its SHA-256
+# ---------------------------------------------------------------------------
+#
+# Layout on disk: <PDF_CACHE_DIR>/<sha256>.json
+#   {"page_count": 912, "pages": {"0": "...", "1": "...", ...}}
+#
+# Pages are filled lazily (only the ones somebody asked for), so the first
+# TOC scan of a 900-page textbook doesn't pay for extracting every page.
+#
+# Recently used entries are also kept in memory, bounded by PDF_CACHE_MEM_ENTRIES
+# documents and PDF_CACHE_MEM_MB of page text (least recently used go first);
+# anything evicted is read back from disk on its next use.
+
+PDF_CACHE_DIR = os.getenv(
+    "PDF_CACHE_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), ".pdf_cache")),
+)
+
+# Large cache fills are split into page chunks and extracted across a process
+# pool. PDF_PARALLEL is "auto" (parallel once PDF_PARALLEL_MIN_PAGES pages are
+# missing), "on" or "off".
+PDF_PARALLEL = os.getenv("PDF_PARALLEL", "auto")
+PDF_PARALLEL_WORKERS = int(os.getenv("PDF_PARALLEL_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+
+PDF_CACHE_MEM_ENTRIES = int(os.getenv("PDF_CACHE_MEM_ENTRIES", "16"))
+PDF_CACHE_MEM_BYTES = int(float(os.getenv("PDF_CACHE_MEM_MB", "64")) * 1024 * 1024)
+
+# Process pools are started with "spawn": forking a server that already runs an
+# event loop, SQLite connections and HTTP threads can deadlock the child
+PROCESS_CONTEXT = multiprocessing.get_context("spawn")
+
+_lock = threading.Lock()
+_parallel_pool: Optional[ProcessPoolExecutor] = None
+# Set by mark_pool_worker() in processes started by one of our pools
+_in_pool_worker = False
+# (abs path, size, mtime_ns) -> sha256, so we don't re-hash unchanged files
+_digests: Dict[Tuple[str, int, int], str] = {}
+# sha256 -> {"page_count": int, "pages": {int: str}}, least recently used first
+_entries: "OrderedDict[str, Dict]" = OrderedDict()
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's contents, memoized by path/size/mtime."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _lock:
+        if key in _digests:
+            return _digests[key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _lock:
+        _digests[key] = digest
+    return digest
+
+
+def _entry_path(digest: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, f"{digest}.json")
+
+
+def _remember(digest: str, entry: Dict) -> Dict:
+    """Keep `entry` in memory and trim the LRU.
+
+    If a copy is already in memory (another thread loaded or reloaded it), the
+    incoming pages are merged into that copy. Caller holds _lock. Returns the
+    entry now in memory for this digest.
+    """
+    current = _entries.get(digest)
+    if current is None:
+        _entries[digest] = current = entry
+    elif current is not entry:
+        current["pages"].update(entry["pages"])
+    _entries.move_to_end(digest)
+    # Page texts are the bulk of an entry; count characters as bytes
+    size = sum(len(t) for e in _entries.values() for t in e["pages"].values())
+    while len(_entries) > 1 and (len(_entries) > PDF_CACHE_MEM_ENTRIES or size > PDF_CACHE_MEM_BYTES):
+        _, evicted = _entries.popitem(last=False)
+        size -= sum(len(t) for t in evicted["pages"].values())
+    return current
+
+
+def _load_entry(digest: str) -> Optional[Dict]:
+    """Return the cache entry for a digest (memory first, then disk)."""
+    with _lock:
+        if digest in _entries:
+            _entries.move_to_end(digest)
+            return _entries[digest]
+    try:
+        with open(_entry_path(digest), "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        entry = {
+            "page_count": int(raw["page_count"]),
+            "pages": {int(k): v for k, v in raw.get("pages", {}).items()},
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+    with _lock:
+        # Another thread may have loaded it meanwhile — the pages are merged
+        return _remember(digest, entry)
+
+
+def _save_entry(digest: str, entry: Dict) -> None:
+    """Write the entry atomically so concurrent workers never read a partial file."""
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    with _lock:
+        payload = {
+            "page_count": entry["page_count"],
+            "pages": {str(k): v for k, v in entry["pages"].items()},
+        }
+    tmp = f"{_entry_path(digest)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp, _entry_path(digest))
+    except OSError as e:
+        print(f"  [PDF cache] Could not persist {digest[:12]}: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def mark_pool_worker() -> None:
+    """ProcessPoolExecutor initializer: tells this process it is a pool worker."""
+    global _in_pool_worker
+    _in_pool_worker = True
+
+
+def _extract_chunk(path: str, indices: List[int]) -> Dict[int, str]:
+    """Process-pool worker: extract one chunk of pages with its own reader."""
+    reader = PdfReader(path)
+    return {i: reader.pages[i].extract_text() or "" for i in indices}
+
+
+def _use_parallel(n_pages: int, parallel: Optional[bool]) -> bool:
+    # Never fan out from inside a pool worker (e.g. PDF_POOL_KIND=process).
+    # multiprocessing.parent_process() can't tell: uvicorn workers have one too.
+    if _in_pool_worker or PDF_PARALLEL_WORKERS < 2:
+        return False
+    if parallel is not None:
+        return parallel and n_pages > 1
+    if PDF_PARALLEL == "on":
+        return n_pages > 1
+    if PDF_PARALLEL == "off":
+        return False
+    return n_pages >= PDF_PARALLEL_MIN_PAGES
+
+
+def _get_parallel_pool() -> ProcessPoolExecutor:
+    global _parallel_pool
+    with _lock:
+        if _parallel_pool is None:
+            _parallel_pool = ProcessPoolExecutor(max_workers=PDF_PARALLEL_WORKERS, mp_context=PROCESS_CONTEXT,
+                                                 initializer=mark_pool_worker)
+        return _parallel_pool
+
+
+def shutdown_parallel_pool() -> None:
+    global _parallel_pool
+    with _lock:
+        pool, _parallel_pool = _parallel_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_pages(path: str, indices: List[int],
+                   parallel: Optional[bool] = None) -> Tuple[int, Dict[int, str]]:
+    """Extract the given 0-indexed pages, fanning out across cores for big fills."""
+    reader = PdfReader(path)
+    total = len(reader.pages)
+    indices = [i for i in indices if 0 <= i < total]
+
+    if _use_parallel(len(indices), parallel):
+        # ~2 chunks per worker keeps cores busy when some pages are slower than others
+        size = max(8, -(-len(indices) // (PDF_PARALLEL_WORKERS * 2)))
+        chunks = [indices[k:k + size] for k in range(0, len(indices), size)]
+        pages: Dict[int, str] = {}
+        for chunk_pages in _get_parallel_pool().map(_extract_chunk, [path] * len(chunks), chunks):
+            pages.update(chunk_pages)
+        return total, pages
+
+    return total, {i: reader.pages[i].extract_text() or "" for i in indices}
+
+
+def get_page_count(path: str) -> int:
+    """Total number of pages, served from cache after the first parse."""
+    digest = file_digest(path)
+    entry = _load_entry(digest)
+    if entry is not None:
+        return entry["page_count"]
+    total = len(PdfReader(path).pages)
+    entry = {"page_count": total, "pages": {}}
+    with _lock:
+        entry = _remember(digest, entry)
+    _save_entry(digest, entry)
+    return entry["page_count"]
+
+
+def get_pages(path: str, indices: Iterable[int],
+              parallel: Optional[bool] = None) -> Dict[int, str]:
+    """Return {page_index: text} for the requested 0-indexed pages.
+
+    Pages already in the cache are a lookup; the rest are extracted (in parallel
+    chunks when the fill is large, see PDF_PARALLEL) and persisted. Out-of-range
+    indices are ignored. Pass parallel=True/False to override PDF_PARALLEL.
+    """
+    digest = file_digest(path)
+    wanted = sorted(set(indices))
+    entry = _load_entry(digest)
+
+    if entry is not None:
+        with _lock:
+            missing = [i for i in wanted if i < entry["page_count"] and i not in entry["pages"]]
+    else:
+        missing = wanted
+
+    fresh: Dict[int, str] = {}
+    if missing or entry is None:
+        total, fresh = _extract_pages(path, missing, parallel)
+        # The entry may have been evicted and reloaded as a new object while we
+        # extracted, so merge into whatever copy is in memory now
+        with _lock:
+            entry = _remember(digest, {"page_count": total, "pages": dict(fresh)})
+        _save_entry(digest, entry)
+
+    with _lock:
+        cached = {i: entry["pages"][i] for i in wanted if i in entry["pages"]}
+    cached.update(fresh)
+    return cached
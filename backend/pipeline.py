@@ -0,0 +1,192 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+# ---------------------------------------------------------------------------
+# Tiny stage-graph executor — run independent agent stages concurrently
+# ---------------------------------------------------------------------------
+#
+# Each Stage declares the named values it reads (inputs) and writes (outputs).
+# The graph wires producers to consumers; at run time every stage starts as
+# soon as its inputs exist, so stages with no data dependency overlap.
+#
+# A lazy stage only runs on demand. Consumers that may not need a value list
+# it in lazy_inputs and receive an async thunk instead: `await syllabus_info()`
+# runs the producer (once) and returns its output.
+#
+# run() optionally takes a checkpoint store (anything with load(stage) and
+# save(stage, value)): finished stages are saved, and on a re-run a stage with a
+# saved result is restored instead of executed.
+#
+# A stage that could only produce a fallback (its LLM call failed) returns
+# Degraded(value): the value flows on as usual, but neither it nor anything
+# computed from it is checkpointed, so the next run tries again.
+
+
+class Degraded:
+    """Stage return value that is usable but must not be checkpointed."""
+
+    def __init__(self, value: Any):
+        self.value = value
+
+
+class Stage:
+    """One async step. `fn` is called with its inputs as keyword arguments.
+
+    With a single output, `fn` returns that value; with several, it returns a
+    dict keyed by output name. Names in `lazy_inputs` are passed as zero-arg
+    async callables that produce the value only when awaited.
+    """
+
+    def __init__(self, name: str, fn: Callable[..., Awaitable[Any]],
+                 inputs: Sequence[str] = (), outputs: Optional[Sequence[str]] = None,
+                 lazy_inputs: Sequence[str] = (), lazy: bool = False, checkpoint: bool = True):
+        self.name = name
+        self.fn = fn
+        self.inputs = list(inputs)
+        self.lazy_inputs = list(lazy_inputs)
+        self.outputs = list(outputs) if outputs is not None else [name]
+        self.lazy = lazy
+        self.checkpoint = checkpoint
+
+
+class StageGraph:
+    def __init__(self, stages: List[Stage], initial: Sequence[str] = ()):
+        self.stages = stages
+        self.initial = list(initial)
+        self.producers: Dict[str, Stage] = {}
+        for stage in stages:
+            for out in stage.outputs:
+                if out in self.producers or out in self.initial:
+                    raise ValueError(f"Value '{out}' is produced more than once")
+                self.producers[out] = stage
+        for stage in stages:
+            for inp in stage.inputs + stage.lazy_inputs:
+                if inp not in self.producers and inp not in self.initial:
+                    raise ValueError(f"Stage '{stage.name}' needs '{inp}', which nothing produces")
+        self.order()  # raises on cycles
+
+    def dependencies(self, stage: Stage) -> List[str]:
+        """Names of the stages this stage waits on."""
+        deps = []
+        for inp in stage.inputs + stage.lazy_inputs:
+            producer = self.producers.get(inp)
+            if producer is not None and producer.name not in deps:
+                deps.append(producer.name)
+        return deps
+
+    def order(self) -> List[List[str]]:
+        """Stage names grouped into levels; stages in one level can run concurrently."""
+        remaining = {s.name: set(self.dependencies(s)) for s in self.stages}
+        levels = []
+        while remaining:
+            ready = sorted(name for name, deps in remaining.items() if not deps)
+            if not ready:
+                raise ValueError(f"Cycle between stages: {sorted(remaining)}")
+            levels.append(ready)
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+        return levels
+
+    def describe(self) -> Dict:
+        """JSON-friendly view of the graph (for logs and the /api/pipeline endpoint)."""
+        return {
+            "initial": self.initial,
+            "stages": [
+                {
+                    "name": s.name,
+                    "inputs": s.inputs,
+                    "lazy_inputs": s.lazy_inputs,
+                    "outputs": s.outputs,
+                    "lazy": s.lazy,
+                    "checkpoint": s.checkpoint,
+                    "depends_on": self.dependencies(s),
+                }
+                for s in self.stages
+            ],
+            "levels": self.order(),
+        }
+
+    async def run(self, initial: Dict[str, Any], checkpoint: Any = None) -> Dict[str, Any]:
+        """Execute every eager stage (and any lazy stage something asked for).
+
+        Returns all initial and produced values; outputs of lazy stages that
+        were never demanded are left out.
+        """
+        missing = [name for name in self.initial if name not in initial]
+        if missing:
+            raise ValueError(f"Missing initial values: {missing}")
+
+        loop = asyncio.get_running_loop()
+        values: Dict[str, asyncio.Future] = {}
+        for name, value in initial.items():
+            values[name] = loop.create_future()
+            values[name].set_result(value)
+        for out in self.producers:
+            values[out] = loop.create_future()
+
+        tasks: Dict[str, asyncio.Task] = {}
+        degraded: set = set()  # value names produced by (or from) a Degraded stage
+
+        def ensure_started(name: str) -> None:
+            producer = self.producers.get(name)
+            if producer is not None and producer.name not in tasks:
+                tasks[producer.name] = asyncio.create_task(run_stage(producer), name=producer.name)
+
+        async def get_value(name: str) -> Any:
+            ensure_started(name)
+            return await values[name]
+
+        def thunk(name: str) -> Callable[[], Awaitable[Any]]:
+            return lambda: get_value(name)
+
+        async def run_stage(stage: Stage) -> None:
+            try:
+                use_checkpoint = checkpoint is not None and stage.checkpoint
+                result = checkpoint.load(stage.name) if use_checkpoint else None
+                if result is None:
+                    kwargs = {}
+                    for inp in stage.inputs:
+                        kwargs[inp] = await get_value(inp)
+                    for inp in stage.lazy_inputs:
+                        kwargs[inp] = thunk(inp)
+                    result = await stage.fn(**kwargs)
+                    is_degraded = isinstance(result, Degraded) or any(
+                        name in degraded for name in stage.inputs + stage.lazy_inputs)
+                    if isinstance(result, Degraded):
+                        result = result.value
+                    if len(stage.outputs) == 1:
+                        result = {stage.outputs[0]: result}
+                    if is_degraded:
+                        degraded.update(stage.outputs)
+                    elif use_checkpoint:
+                        checkpoint.save(stage.name, result)
+            except BaseException as e:
+                # Fail the outputs too: a consumer awaiting one (possibly a lazy
+                # value the final gather below doesn't know about) must not hang
+                for out in stage.outputs:
+                    if not values[out].done():
+                        if isinstance(e, asyncio.CancelledError):
+                            values[out].cancel()
+                        else:
+                            values[out].set_exception(e)
+                raise
+            for out in stage.outputs:
+                values[out].set_result(result[out])
+
+        for stage in self.stages:
+            if not stage.lazy:
+                ensure_started(stage.outputs[0])
+        try:
+            # Lazy stages can be started while we wait, so keep gathering until stable
+            while not all(t.done() for t in tasks.values()):
+                await asyncio.gather(*tasks.values())
+        except BaseException:
+            for t in tasks.values():
+                t.cancel()
+            for fut in values.values():
+                if fut.done() and not fut.cancelled():
+                    fut.exception()  # mark retrieved; the error is re-raised below
+            raise
+        return {name: fut.result() for name, fut in values.items() if fut.done()}
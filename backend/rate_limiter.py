@@ -0,0 +1,132 @@
+import time
+import asyncio
+from typing import Dict, Optional
+
+# ---------------------------------------------------------------------------
+# Async token-bucket rate limiter for Gemini calls
+# ---------------------------------------------------------------------------
+#
+# Two buckets: one for requests per minute, one for tokens per minute. Waiters
+# are served strictly first-come-first-served (asyncio.Lock wakes waiters in
+# FIFO order), so one session can't starve another.
+
+
+class TokenBucket:
+    """Classic token bucket: refills continuously at rate_per_minute up to capacity."""
+
+    def __init__(self, rate_per_minute: float, capacity: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        # May go negative when actual usage exceeds the estimate — that debt
+        # simply delays the next caller.
+        self.tokens -= amount
+
+    def refund(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """RPM + TPM limiter with FIFO waiters and wait-time metrics."""
+
+    def __init__(self, rpm: float, tpm: float = 0, burst: float = 1, name: str = "Rate limiter"):
+        self.name = name
+        self.requests = TokenBucket(rpm, max(1.0, burst))
+        self.tokens = TokenBucket(tpm, tpm) if tpm > 0 else None
+        self._lock: Optional[asyncio.Lock] = None
+        self.waiting = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.tokens_reserved = 0
+        self.tokens_used = 0
+        self.released = 0
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Wait for one request slot plus `tokens` estimated tokens. Returns seconds waited."""
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._get_lock():
+                while True:
+                    wait = self.requests.time_until(1)
+                    if self.tokens is not None and tokens:
+                        wait = max(wait, self.tokens.time_until(tokens))
+                    if wait <= 0:
+                        break
+                    print(f"  [{self.name}] Waiting {wait:.1f}s to stay under rate limits...")
+                    await asyncio.sleep(wait)
+                self.requests.consume(1)
+                if self.tokens is not None and tokens:
+                    self.tokens.consume(tokens)
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.tokens_reserved += tokens
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def record_usage(self, estimated: int, actual: int) -> None:
+        """Settle a reservation against the real token count from usage_metadata."""
+        self.tokens_used += actual
+        if self.tokens is None or actual == estimated:
+            return
+        if actual > estimated:
+            self.tokens.consume(actual - estimated)
+        else:
+            self.tokens.refund(estimated - actual)
+
+    def release(self, estimated: int, used: int = 0) -> None:
+        """Settle a reservation whose call was cancelled before it finished.
+
+        The request slot stays spent (the API has already counted it), but the
+        unused part of the token reservation goes straight back to the bucket.
+        """
+        self.released += 1
+        self.record_usage(estimated, used)
+
+    def metrics(self) -> Dict:
+        return {
+            "rpm": self.requests.rate * 60,
+            "tpm": self.tokens.rate * 60 if self.tokens else None,
+            "burst": self.requests.capacity,
+            "waiting": self.waiting,
+            "acquired": self.acquired,
+            "total_wait_s": round(self.total_wait, 2),
+            "avg_wait_s": round(self.total_wait / self.acquired, 2) if self.acquired else 0.0,
+            "max_wait_s": round(self.max_wait, 2),
+            "tokens_reserved": self.tokens_reserved,
+            "tokens_used": self.tokens_used,
+            "released": self.released,
+        }
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough prompt size (~4 chars per token) used to reserve TPM before a call."""
+    return sum(len(t) for t in texts if t) // 4 + 1
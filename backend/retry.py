@@ -0,0 +1,140 @@
+import re
+import time
+import random
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Optional
+
+# ---------------------------------------------------------------------------
+# Retry policy for transient Gemini errors (429 / 5xx / network)
+# ---------------------------------------------------------------------------
+#
+# Exponential backoff with full jitter. A server-provided delay (RetryInfo in
+# the error details, or a Retry-After header) wins over the computed backoff.
+# Each call has an overall deadline, and each plan session has a shared retry
+# budget so one bad session can't retry forever under load. Time spent queued
+# on the rate limiter (the `acquire` hook) doesn't count against the deadline:
+# waiting behind other sessions is not a failure.
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class RetryBudget:
+    """Retries allowed across a whole plan session."""
+
+    def __init__(self, retries: int):
+        self.remaining = retries
+        self.used = 0
+
+    def take(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        self.used += 1
+        return True
+
+
+# Set by the workflow for each session; child tasks inherit it.
+current_retry_budget: contextvars.ContextVar[Optional[RetryBudget]] = contextvars.ContextVar(
+    "current_retry_budget", default=None
+)
+
+
+def status_code(exc: BaseException) -> Optional[int]:
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError, TimeoutError)):
+        return True
+    code = status_code(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    # httpx transport errors (connection reset, read timeout) — matched by name
+    # so this module doesn't need httpx as a hard import
+    return type(exc).__name__ in ("ConnectError", "ReadTimeout", "RemoteProtocolError", "ReadError")
+
+
+def server_retry_delay(exc: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, if it said."""
+    details = getattr(exc, "details", None)
+    if isinstance(details, dict):
+        details = details.get("error", details).get("details", [])
+    if isinstance(details, list):
+        for d in details:
+            if isinstance(d, dict) and "retryDelay" in d:
+                m = re.match(r"^\s*([\d.]+)s\s*$", str(d["retryDelay"]))
+                if m:
+                    return float(m.group(1))
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 5, base_delay: float = 2.0,
+                 max_delay: float = 60.0, deadline: float = 300.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retries = 0
+        self.gave_up = 0
+
+    def backoff(self, attempt: int) -> float:
+        """Full jitter: uniform in [0, min(max_delay, base * 2^attempt)]."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def run(self, fn: Callable[[], Awaitable[Any]], label: str = "call",
+                  acquire: Optional[Callable[[], Awaitable[float]]] = None) -> Any:
+        """Call `fn` until it succeeds or the error isn't worth retrying.
+
+        `acquire`, if given, is awaited before every attempt outside the
+        deadline and returns the seconds it waited (e.g. RateLimiter.acquire).
+        """
+        started = time.monotonic()
+        queued = 0.0
+        attempt = 0
+        while True:
+            if acquire is not None:
+                queued += await acquire()
+            remaining = self.deadline - (time.monotonic() - started - queued)
+            try:
+                return await asyncio.wait_for(fn(), timeout=max(remaining, 0.001))
+            except Exception as e:
+                attempt += 1
+                if not is_retryable(e) or attempt >= self.max_attempts:
+                    raise
+                delay = server_retry_delay(e)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                delay = min(delay, self.max_delay)
+                if time.monotonic() - started - queued + delay >= self.deadline:
+                    self.gave_up += 1
+                    print(f"  [Retry] {label}: deadline of {self.deadline:.0f}s reached, giving up")
+                    raise
+                budget = current_retry_budget.get()
+                if budget is not None and not budget.take():
+                    self.gave_up += 1
+                    print(f"  [Retry] {label}: session retry budget exhausted, giving up")
+                    raise
+                self.retries += 1
+                print(f"  [Retry] {label} failed ({status_code(e) or type(e).__name__}), "
+                      f"attempt {attempt}/{self.max_attempts} — retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def metrics(self) -> dict:
+        return {
+            "max_attempts": self.max_attempts,
+            "deadline_s": self.deadline,
+            "retries": self.retries,
+            "gave_up": self.gave_up,
+        }
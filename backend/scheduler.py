@@ -0,0 +1,378 @@
+import math
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+# ---------------------------------------------------------------------------
+# Local scheduler — a zero-token alternative to ChiefOrchestrator
+# ---------------------------------------------------------------------------
+#
+# Takes the same compressed course/topic structure the orchestrator gets
+# (see agents.compress_courses) and bin-packs topics into days:
+#
+# - each topic becomes learn → practice → review tasks, split from its hours
+# - practice is never on the same day as (or before) its learn session
+# - each course works at an even pace (remaining hours / remaining days), so
+#   tasks spread out until the exam instead of bunching at the start
+# - the most urgent course (least slack) is served first each day
+# - every REST_EVERY study days there is a rest day; noStudyDates are skipped
+# - HARD DEADLINE: nothing on or after a course's exam_date — if a course
+#   doesn't fit, its lowest-importance topics are dropped and rescheduled
+#   (an exam on or before the start day means every topic is dropped)
+#
+# It runs in milliseconds and never calls the LLM.
+
+IMPORTANCE_RANK = {"high": 0, "medium": 1, "low": 2}
+TASK_SPLIT = (("learn", 0.5), ("practice", 0.3), ("review", 0.2))
+SLOT = 0.5            # hours are scheduled in half-hour units
+REST_EVERY = 5        # study days between rest days
+DEFAULT_HORIZON = 28  # days to plan for a course with no known exam date
+
+
+def _round_slot(hours: float) -> float:
+    return max(SLOT, round(hours / SLOT) * SLOT)
+
+
+def _parse_date(value: str) -> Optional[date]:
+    try:
+        return datetime.strptime(str(value), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def study_calendar(start: date, end: date, constraints: Dict) -> Dict[date, float]:
+    """Hour budget for every study day in [start, end), with rest days removed."""
+    blocked = {d for d in (_parse_date(x) for x in constraints.get("noStudyDates", [])) if d}
+    weekday = float(constraints.get("weekdayHours", 3))
+    weekend = float(constraints.get("weekendHours", 6))
+    days: Dict[date, float] = {}
+    streak = 0
+    d = start
+    while d < end:
+        if d not in blocked:
+            if streak == REST_EVERY:
+                streak = 0  # rest day
+            else:
+                days[d] = weekend if d.weekday() >= 5 else weekday
+                streak += 1
+        d += timedelta(days=1)
+    return days
+
+
+def split_topic(course: str, topic: Dict, notes_for=None) -> List[Dict]:
+    """Turn one topic into its learn/practice/review tasks."""
+    hours = float(topic.get("hours", 2.0) or 2.0)
+    tasks = []
+    for task_type, share in TASK_SPLIT:
+        resource = topic.get("resource", "Textbook")
+        tasks.append({
+            "course": course,
+            "topic": topic["topic"],
+            "task_type": task_type,
+            "duration_hours": _round_slot(hours * share),
+            "resources": resource,
+            "notes": notes_for(course, topic["topic"], task_type, resource) if notes_for else "",
+            "importance": topic.get("importance", "medium"),
+        })
+    return tasks
+
+
+def default_notes(course: str, topic: str, task_type: str, resource: str) -> str:
+    if task_type == "learn":
+        return f"Focus: {topic} — read {resource} | Memorize: key definitions from {resource}"
+    if task_type == "practice":
+        return f"Practice: worked problems on {topic} from {resource} | Self-Test: redo one without notes"
+    return f"Self-Test: explain {topic} from memory, then check against {resource}"
+
+
+def _simulate(courses: List[Dict], calendar: Dict[date, float]) -> Dict:
+    """One greedy pass. Returns scheduled tasks plus whatever didn't fit per course."""
+    days = sorted(calendar)
+    remaining_cap = dict(calendar)
+    queues = {c["code"]: [dict(t) for t in c["tasks"]] for c in courses}
+    deadline = {c["code"]: c["deadline"] for c in courses}
+    learned_on: Dict[tuple, date] = {}  # (course, topic, task_type) -> finish date
+    scheduled: List[Dict] = []
+
+    def ready(task: Dict, today: date) -> bool:
+        key = (task["course"], task["topic"])
+        if task["task_type"] == "practice":
+            done = learned_on.get(key + ("learn",))
+            return done is not None and done < today
+        if task["task_type"] == "review":
+            done = learned_on.get(key + ("practice",))
+            return done is not None and done < today
+        return True
+
+    for today in days:
+        open_courses = [code for code, q in queues.items() if q and today < deadline[code]]
+        # Least slack first: hours left per study day left before the deadline
+        def pressure(code: str) -> float:
+            days_left = sum(1 for d in days if today <= d < deadline[code])
+            return sum(t["duration_hours"] for t in queues[code]) / max(days_left, 1)
+
+        for code in sorted(open_courses, key=pressure, reverse=True):
+            pace = math.ceil(pressure(code) / SLOT) * SLOT
+            budget = min(pace, remaining_cap[today])
+            queue = queues[code]
+            i = 0
+            while budget >= SLOT and i < len(queue):
+                task = queue[i]
+                if not ready(task, today):
+                    i += 1
+                    continue
+                hours = min(task["duration_hours"], budget)
+                scheduled.append(dict(task, date=today.isoformat(), duration_hours=hours))
+                budget -= hours
+                remaining_cap[today] -= hours
+                if hours < task["duration_hours"]:
+                    # Split: the rest of this task carries over to a later day
+                    task["duration_hours"] -= hours
+                    break
+                learned_on[(task["course"], task["topic"], task["task_type"])] = today
+                queue.pop(i)
+
+    return {"tasks": scheduled, "unscheduled": {code: q for code, q in queues.items() if q}}
+
+
+def schedule_locally(compressed: List[Dict], constraints: Dict,
+                     start: Optional[date] = None, notes_for=default_notes) -> Dict:
+    """Build a plan from compressed course data without calling the LLM.
+
+    Returns {"tasks": [...StudyTask...], "dropped": [{course, topic, importance}]}.
+    """
+    start = start or (datetime.now().date() + timedelta(days=1))
+    courses = []
+    dropped: List[Dict] = []
+    for c in compressed:
+        exam = _parse_date(c.get("exam_date", ""))
+        topics = sorted(
+            enumerate(c.get("topics", [])),
+            key=lambda it: (IMPORTANCE_RANK.get(str(it[1].get("importance", "medium")).lower(), 1), it[0]),
+        )
+        if exam and exam <= start:
+            # The exam is before the first study day: there is no time for any of it
+            dropped.extend({"course": c.get("code", "COURSE"), "topic": t["topic"],
+                            "importance": t.get("importance", "medium")} for _, t in topics)
+            continue
+        deadline = exam or start + timedelta(days=DEFAULT_HORIZON)
+        courses.append({
+            "code": c.get("code", "COURSE"),
+            "deadline": deadline,
+            "topics": [t for _, t in topics],
+        })
+
+    end = max((c["deadline"] for c in courses), default=start)
+    calendar = study_calendar(start, end, constraints)
+
+    while True:
+        for c in courses:
+            c["tasks"] = [t for topic in c["topics"] for t in split_topic(c["code"], topic, notes_for)]
+            # Learn/practice in priority order first, reviews last (closest to the exam)
+            c["tasks"].sort(key=lambda t: t["task_type"] == "review")
+        result = _simulate(courses, calendar)
+        if not result["unscheduled"]:
+            break
+        # Drop the least important remaining topic of each course that overflowed
+        progress = False
+        for c in courses:
+            if c["code"] in result["unscheduled"] and len(c["topics"]) > 1:
+                topic = c["topics"].pop()
+                dropped.append({"course": c["code"], "topic": topic["topic"],
+                                "importance": topic.get("importance", "medium")})
+                progress = True
+        if not progress:
+            # Even one topic doesn't fit — keep what was scheduled and report the rest
+            for code, queue in result["unscheduled"].items():
+                for topic in dict.fromkeys((t["topic"], t["importance"]) for t in queue):
+                    dropped.append({"course": code, "topic": topic[0], "importance": topic[1]})
+            break
+
+    tasks = sorted(result["tasks"], key=lambda t: (t["date"], t["course"]))
+    for t in tasks:
+        t.pop("importance", None)
+    return {"tasks": tasks, "dropped": dropped}
+
+
+# ---------------------------------------------------------------------------
+# Validator + repair pass for orchestrator output
+# ---------------------------------------------------------------------------
+#
+# The LLM plan is checked task by task against the same rules the local
+# scheduler follows (daily budget, noStudyDates, nothing before the start or
+# on/after a course's exam_date). Violations are fixed locally — tasks are
+# moved to the nearest day with room, split across days, or, as a last resort,
+# the lowest-importance ones are dropped — and every change is reported.
+
+
+def _day_budget(d: date, constraints: Dict, blocked: set) -> float:
+    if d in blocked:
+        return 0.0
+    return float(constraints.get("weekendHours", 6) if d.weekday() >= 5 else constraints.get("weekdayHours", 3))
+
+
+def validate_and_repair(tasks: List, compressed: List[Dict], constraints: Dict,
+                        start: Optional[date] = None) -> Dict:
+    """Check every task against the constraints and repair violations in place.
+
+    Returns {"tasks": [...], "changes": [{action, course, topic, task_type, from, to, reason}]}.
+    """
+    start = start or (datetime.now().date() + timedelta(days=1))
+    blocked = {d for d in (_parse_date(x) for x in constraints.get("noStudyDates", [])) if d}
+    deadlines: Dict[str, date] = {}
+    importance: Dict[tuple, int] = {}
+    for c in compressed:
+        exam = _parse_date(c.get("exam_date", ""))
+        if exam:
+            deadlines[c.get("code", "")] = exam
+        for t in c.get("topics", []):
+            importance[(c.get("code", ""), t.get("topic", ""))] = IMPORTANCE_RANK.get(
+                str(t.get("importance", "medium")).lower(), 1)
+
+    changes: List[Dict] = []
+
+    def note(action: str, task: Dict, reason: str, frm="", to="") -> None:
+        changes.append({"action": action, "course": task.get("course", ""), "topic": task.get("topic", ""),
+                        "task_type": task.get("task_type", ""), "from": frm, "to": to, "reason": reason})
+
+    def rank(task: Dict) -> int:
+        return importance.get((task.get("course", ""), task.get("topic", "")), 1)
+
+    def deadline(task: Dict) -> date:
+        return deadlines.get(task.get("course", ""), date.max)
+
+    # 1. Per-task checks — anything with a bad date is displaced
+    by_day: Dict[date, List[Dict]] = {}
+    displaced: List[Dict] = []
+    for task in tasks:
+        if not isinstance(task, dict):
+            continue
+        try:
+            hours = float(task.get("duration_hours", 0))
+        except (TypeError, ValueError):
+            hours = 0.0
+        if hours <= 0:
+            note("dropped", task, "missing or non-positive duration")
+            continue
+        task["duration_hours"] = hours
+        d = _parse_date(task.get("date", ""))
+        if d is None:
+            reason = "invalid date"
+        elif d < start:
+            reason = "scheduled before the start date"
+        elif d in blocked:
+            reason = "scheduled on a no-study date"
+        elif d >= deadline(task):
+            reason = "scheduled on or after the exam date"
+        else:
+            by_day.setdefault(d, []).append(task)
+            continue
+        task["_reason"] = reason
+        displaced.append(task)
+
+    # 2. Daily budget — shed the least important tasks from overloaded days
+    for d, day_tasks in by_day.items():
+        budget = _day_budget(d, constraints, blocked)
+        day_tasks.sort(key=lambda t: (rank(t), t.get("task_type") == "review"))
+        while sum(t["duration_hours"] for t in day_tasks) > budget + 1e-9:
+            task = day_tasks.pop()
+            task["_reason"] = "daily hour budget exceeded"
+            displaced.append(task)
+
+    # 3. Re-place displaced tasks, most important first, nearest valid day first
+    used = {d: sum(t["duration_hours"] for t in ts) for d, ts in by_day.items()}
+    last_day = max(list(deadlines.values()) + list(by_day) + [start + timedelta(days=DEFAULT_HORIZON)])
+    for task in sorted(displaced, key=rank):
+        origin = task.get("date", "")
+        reason = task.pop("_reason")
+        anchor = _parse_date(origin) or start
+        candidates = []
+        d = start
+        while d < min(deadline(task), last_day + timedelta(days=1)):
+            room = _day_budget(d, constraints, blocked) - used.get(d, 0.0)
+            if room >= SLOT:
+                candidates.append((abs((d - anchor).days), d, room))
+            d += timedelta(days=1)
+        candidates.sort()
+
+        remaining = task["duration_hours"]
+        placed = []
+        for _, d, room in candidates:
+            if remaining < SLOT / 2:
+                break
+            hours = min(remaining, math.floor(room / SLOT) * SLOT)
+            if hours <= 0:
+                continue
+            by_day.setdefault(d, []).append(dict(task, date=d.isoformat(), duration_hours=hours))
+            used[d] = used.get(d, 0.0) + hours
+            remaining -= hours
+            placed.append(d.isoformat())
+
+        if not placed:
+            note("dropped", task, f"{reason}; no free time before the exam", frm=origin)
+        elif len(placed) == 1 and remaining < SLOT / 2:
+            note("moved", task, reason, frm=origin, to=placed[0])
+        else:
+            note("split", task, reason, frm=origin, to=", ".join(placed))
+            if remaining >= SLOT / 2:
+                note("dropped", dict(task, duration_hours=remaining),
+                     f"{reason}; only part of the task fit before the exam", frm=origin)
+
+    repaired = [t for d in sorted(by_day) for t in by_day[d]]
+    return {"tasks": repaired, "changes": changes}
+
+
+# ---------------------------------------------------------------------------
+# Hour-budget split for sharded (per-course) orchestrator calls
+# ---------------------------------------------------------------------------
+
+
+def _allocate_slots(budget: float, shares: Dict[str, float]) -> Dict[str, float]:
+    """Split `budget` hours into half-hour slots by share (largest remainder)."""
+    slots = int(math.floor(budget / SLOT + 1e-9))
+    alloc = {code: 0 for code in shares}
+    active = [code for code, share in shares.items() if share > 0]
+    if 0 < len(active) <= slots:
+        for code in active:
+            alloc[code] = 1
+        slots -= len(active)
+    quotas = {code: slots * share for code, share in shares.items()}
+    for code, quota in quotas.items():
+        alloc[code] += math.floor(quota)
+    leftover = slots - sum(math.floor(q) for q in quotas.values())
+    by_remainder = sorted(shares, key=lambda code: (quotas[code] - math.floor(quotas[code]), shares[code]),
+                          reverse=True)
+    for code in by_remainder[:leftover]:
+        alloc[code] += 1
+    return {code: n * SLOT for code, n in alloc.items()}
+
+
+def split_hour_budget(compressed: List[Dict], constraints: Dict,
+                      start: Optional[date] = None) -> Dict[str, Dict]:
+    """Give each course its own constraints with a share of the daily hours.
+
+    Shares are proportional to how hard each course pushes on the calendar
+    (topic hours / days until its exam) and handed out in half-hour slots by
+    largest remainder, so the shards' hours always add up to at most the
+    budget and can't overbook a day when they're merged. Every course gets at
+    least one slot when there are enough to go round; with more courses than
+    slots, the least pressed ones get none on that kind of day.
+    """
+    start = start or (datetime.now().date() + timedelta(days=1))
+    demand = {}
+    for c in compressed:
+        hours = sum(float(t.get("hours", 2.0) or 2.0) for t in c.get("topics", []))
+        exam = _parse_date(c.get("exam_date", ""))
+        if exam and exam <= start:
+            demand[c.get("code", "")] = 0.0  # exam already here: no study days to give it
+            continue
+        days = (exam - start).days if exam else DEFAULT_HORIZON
+        demand[c.get("code", "")] = hours / max(days, 1)
+    total = sum(demand.values()) or 1.0
+    shares = {code: d / total for code, d in demand.items()}
+
+    weekday = _allocate_slots(float(constraints.get("weekdayHours", 3)), shares)
+    weekend = _allocate_slots(float(constraints.get("weekendHours", 6)), shares)
+    shards = {}
+    for code in shares:
+        shards[code] = dict(constraints, weekdayHours=weekday[code], weekendHours=weekend[code])
+    return shards
@@ -0,0 +1,94 @@
+from typing import List
+from pydantic import BaseModel, ConfigDict
+
+# ---------------------------------------------------------------------------
+# Response schemas — one per agent
+# ---------------------------------------------------------------------------
+#
+# Agents without tools pass these to Gemini as output_schema, so the response
+# shape is enforced while it's generated. StudyGuideGuru has tools (which
+# can't be combined with a response schema), so its output is validated after
+# the fact against the same kind of model.
+#
+# Fields have no defaults on purpose: the Gemini API rejects schema defaults,
+# and a missing field should fail validation rather than slip through.
+
+
+class AgentResponse(BaseModel):
+    # Models sometimes answer "week": 3 where the schema says string
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+
+class Module(AgentResponse):
+    name: str
+    topics: List[str]
+    week: str
+
+
+class Assessment(AgentResponse):
+    type: str
+    weight: str
+    date: str
+
+
+class SyllabusResult(AgentResponse):
+    course_name: str
+    course_code: str
+    modules: List[Module]
+    assessments: List[Assessment]
+
+
+class ScopeTopic(AgentResponse):
+    name: str
+    importance: str
+
+
+class ExamScopeResult(AgentResponse):
+    exam_date: str
+    topics: List[ScopeTopic]
+
+
+class TocSection(AgentResponse):
+    chapter: str
+    start_page: int
+    end_page: int
+    covers_topics: List[str]
+
+
+class TocResult(AgentResponse):
+    relevant_sections: List[TocSection]
+
+
+class TopicMapping(AgentResponse):
+    topic: str
+    resource: str
+    estimated_hours: float
+
+
+class StudyGuideResult(AgentResponse):
+    mappings: List[TopicMapping]
+
+
+class PlanTask(AgentResponse):
+    date: str
+    course: str
+    topic: str
+    task_type: str
+    duration_hours: float
+    resources: str
+
+
+class StudyPlanResult(AgentResponse):
+    tasks: List[PlanTask]
+
+
+class TopicNotes(AgentResponse):
+    topic: str
+    focus: str
+    practice: str
+    memorize: str
+    self_test: str
+
+
+class NotesResult(AgentResponse):
+    notes: List[TopicNotes]
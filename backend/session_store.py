@@ -0,0 +1,553 @@
+import os
+import json
+import time
+import sqlite3
+import queue
+import hashlib
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ---------------------------------------------------------------------------
+# Session store — job state, log/event stream, results and partial plans
+# ---------------------------------------------------------------------------
+#
+# Two interchangeable backends behind the same methods:
+#
+#   MemoryStore  dicts in this process (single uvicorn worker, the default)
+#   SqliteStore  one SQLite file in WAL mode shared by every worker process,
+#                so a session can be served by a worker that didn't run it
+#                and results survive a restart
+#
+# SqliteStore never commits on the caller's thread: writes are queued to one
+# writer thread, which applies everything queued so far in a single
+# transaction. A write returns immediately, so add_log() and friends are safe
+# to call from the event loop. Reads first wait until this process's earlier
+# writes have landed (read-your-writes) and then query, so async callers should
+# run them in a thread (main.store_io does).
+#
+# Everything a client sees goes through the event stream: each session has an
+# append-only list of (seq, kind, entry) where kind is "log" (agent logs),
+# "task" (streamed plan tasks) or "done" (end of the run). SSE handlers poll
+# events_after(seq), so they work the same no matter which process appended.
+#
+# Job records carry the run_id of the job they describe. update_job() only
+# touches a record if the run_id still matches, so a superseded run can't
+# overwrite its replacement's state.
+#
+# Clients heartbeat with touch_client() while an SSE stream is open; the job
+# owner reads last_client_seen() to spot abandoned plans.
+#
+# Eviction: evict() drops whole sessions that are finished and either past
+# their TTL or, oldest activity first, over the session-count / byte caps.
+# Sessions with a live job are never evicted. With a spill directory, an
+# evicted session's result is written to disk first and get_result() still
+# finds it there. Spill files have their own TTL and byte cap, applied on
+# every evict() pass (oldest files go first).
+
+
+class EvictionPolicy:
+    """When finished sessions leave the store. 0 disables a limit."""
+
+    def __init__(self, ttl_seconds: float = 0, max_sessions: int = 0, max_bytes: int = 0,
+                 spill_dir: Optional[str] = None, spill_ttl_seconds: float = 0, spill_max_bytes: int = 0):
+        self.ttl = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_ttl = spill_ttl_seconds
+        self.spill_max_bytes = spill_max_bytes
+
+
+def _size(value: Any) -> int:
+    return len(json.dumps(value))
+
+
+class _StoreBase:
+    def __init__(self, eviction: Optional[EvictionPolicy] = None):
+        self.eviction = eviction or EvictionPolicy()
+        self.evicted = {"ttl": 0, "lru": 0}
+        self.spilled = 0
+        self.spill_reads = 0
+        self.spill_pruned = 0
+        if self.eviction.spill_dir:
+            os.makedirs(self.eviction.spill_dir, exist_ok=True)
+
+    def _spill_path(self, session_id: str) -> str:
+        # Session ids come from clients, so never use them as file names directly
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.eviction.spill_dir, f"{name}.json")
+
+    def _spill(self, session_id: str, value: Any) -> None:
+        path = self._spill_path(session_id)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+        self.spilled += 1
+
+    def _read_spilled(self, session_id: str) -> Optional[Any]:
+        if not self.eviction.spill_dir:
+            return None
+        try:
+            with open(self._spill_path(session_id), "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.spill_reads += 1
+        return value
+
+    def _delete_spilled(self, session_id: str) -> None:
+        if self.eviction.spill_dir:
+            try:
+                os.remove(self._spill_path(session_id))
+            except FileNotFoundError:
+                pass
+
+    def _spill_files(self) -> List[Tuple[float, int, str]]:
+        """(mtime, size, path) of every spilled result, oldest first."""
+        files = []
+        try:
+            names = os.listdir(self.eviction.spill_dir)
+        except OSError:
+            return files
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.eviction.spill_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        return files
+
+    def prune_spill(self) -> int:
+        """Delete spilled results past the spill TTL, then the oldest over the byte cap."""
+        policy = self.eviction
+        if not policy.spill_dir or not (policy.spill_ttl > 0 or policy.spill_max_bytes > 0):
+            return 0
+        now = time.time()
+        files = self._spill_files()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in files:
+            expired = policy.spill_ttl > 0 and now - mtime > policy.spill_ttl
+            over = policy.spill_max_bytes > 0 and total > policy.spill_max_bytes
+            if not (expired or over):
+                break  # oldest first: nothing later is expired or needed to fit
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self.spill_pruned += removed
+        return removed
+
+    def evict(self, stale_after: float = 30.0) -> Dict[str, str]:
+        """Drop finished sessions past their TTL, then LRU ones over the caps.
+
+        A session counts as live (and is kept) while its job record is queued
+        or running and was refreshed within `stale_after` seconds. Returns
+        {session_id: "ttl" | "lru"} for every session dropped.
+        """
+        policy = self.eviction
+        now = time.time()
+        stats = self.session_stats()
+        live = {sid for sid, st in stats.items()
+                if st["job_state"] in ("queued", "running") and now - st["job_updated"] <= stale_after}
+
+        doomed: Dict[str, str] = {}
+        if policy.ttl > 0:
+            for sid, st in stats.items():
+                if sid not in live and st["completed"] and now - st["completed"] > policy.ttl:
+                    doomed[sid] = "ttl"
+
+        count = len(stats) - len(doomed)
+        total = sum(st["bytes"] for sid, st in stats.items() if sid not in doomed)
+        for sid in sorted(stats, key=lambda k: stats[k]["accessed"]):
+            over_count = policy.max_sessions > 0 and count > policy.max_sessions
+            over_bytes = policy.max_bytes > 0 and total > policy.max_bytes
+            if not (over_count or over_bytes):
+                break
+            if sid in live or sid in doomed:
+                continue
+            doomed[sid] = "lru"
+            count -= 1
+            total -= stats[sid]["bytes"]
+
+        dropped: Dict[str, str] = {}
+        for sid, reason in doomed.items():
+            result = self.get_result(sid) if policy.spill_dir else None
+            if not self.drop_session(sid, since=now):
+                continue  # a new job was submitted since session_stats()
+            if result is not None:
+                self._spill(sid, result)
+            self.evicted[reason] += 1
+            dropped[sid] = reason
+        self.prune_spill()
+        return dropped
+
+    def flush(self) -> None:
+        """Block until every write made so far is stored (a no-op unless writes are queued)."""
+
+    def metrics(self) -> Dict:
+        stats = self.session_stats()
+        spill = self._spill_files() if self.eviction.spill_dir else []
+        return {
+            "sessions": len(stats),
+            "bytes": sum(st["bytes"] for st in stats.values()),
+            "max_sessions": self.eviction.max_sessions,
+            "max_bytes": self.eviction.max_bytes,
+            "ttl_s": self.eviction.ttl,
+            "evicted_ttl": self.evicted["ttl"],
+            "evicted_lru": self.evicted["lru"],
+            "spilled": self.spilled,
+            "spill_reads": self.spill_reads,
+            "spill_pruned": self.spill_pruned,
+            "spill_files": len(spill),
+            "spill_bytes": sum(size for _, size, _ in spill),
+        }
+
+
+class MemoryStore(_StoreBase):
+    shared = False
+
+    def __init__(self, eviction: Optional[EvictionPolicy] = None):
+        super().__init__(eviction)
+        self._seq = 0
+        self._events: Dict[str, List[Tuple[int, str, Dict]]] = {}
+        self._results: Dict[str, Any] = {}
+        self._partials: Dict[str, Dict[str, Dict]] = {}
+        self._jobs: Dict[str, Dict] = {}
+        self._clients: Dict[str, float] = {}
+        # Per-session bookkeeping for eviction: approximate JSON bytes held,
+        # last activity, and when the result was written
+        self._event_bytes: Dict[str, int] = {}
+        self._result_bytes: Dict[str, int] = {}
+        self._partial_bytes: Dict[str, Dict[str, int]] = {}
+        self._accessed: Dict[str, float] = {}
+        self._completed: Dict[str, float] = {}
+
+    def _touch(self, session_id: str) -> None:
+        self._accessed[session_id] = time.time()
+
+    # -- event stream --
+    def append_event(self, session_id: str, kind: str, entry: Dict) -> int:
+        self._seq += 1
+        self._events.setdefault(session_id, []).append((self._seq, kind, entry))
+        self._event_bytes[session_id] = self._event_bytes.get(session_id, 0) + _size(entry)
+        self._touch(session_id)
+        return self._seq
+
+    def events_after(self, session_id: str, after: int = 0) -> List[Tuple[int, str, Dict]]:
+        return [e for e in self._events.get(session_id, []) if e[0] > after]
+
+    def clear_events(self, session_id: str) -> None:
+        self._events.pop(session_id, None)
+        self._event_bytes.pop(session_id, None)
+
+    # -- results --
+    def set_result(self, session_id: str, value: Any) -> None:
+        self._results[session_id] = value
+        self._result_bytes[session_id] = _size(value)
+        self._completed[session_id] = time.time()
+        self._touch(session_id)
+
+    def get_result(self, session_id: str) -> Optional[Any]:
+        if session_id in self._results:
+            self._touch(session_id)
+            return self._results[session_id]
+        return self._read_spilled(session_id)
+
+    def delete_result(self, session_id: str) -> None:
+        self._results.pop(session_id, None)
+        self._result_bytes.pop(session_id, None)
+        self._completed.pop(session_id, None)
+        self._delete_spilled(session_id)
+
+    # -- partial plans --
+    def set_partial(self, session_id: str, key: str, task: Dict) -> None:
+        self._partials.setdefault(session_id, {})[key] = task
+        self._partial_bytes.setdefault(session_id, {})[key] = _size(task)
+
+    def get_partials(self, session_id: str) -> List[Dict]:
+        return list(self._partials.get(session_id, {}).values())
+
+    def clear_partials(self, session_id: str) -> None:
+        self._partials.pop(session_id, None)
+        self._partial_bytes.pop(session_id, None)
+
+    # -- jobs --
+    def put_job(self, session_id: str, record: Dict) -> None:
+        self._jobs[session_id] = dict(record, updated=time.time())
+        self._touch(session_id)
+
+    def get_job(self, session_id: str) -> Optional[Dict]:
+        record = self._jobs.get(session_id)
+        return dict(record) if record is not None else None
+
+    def update_job(self, session_id: str, run_id: str, **fields) -> None:
+        record = self._jobs.get(session_id)
+        if record is not None and record.get("run_id") == run_id:
+            record.update(fields, updated=time.time())
+
+    # -- client heartbeats --
+    def touch_client(self, session_id: str) -> None:
+        self._clients[session_id] = time.time()
+
+    def last_client_seen(self, session_id: str) -> Optional[float]:
+        return self._clients.get(session_id)
+
+    # -- eviction --
+    def session_stats(self) -> Dict[str, Dict]:
+        sessions = (set(self._events) | set(self._results) | set(self._partials)
+                    | set(self._jobs) | set(self._clients))
+        stats = {}
+        for sid in sessions:
+            job = self._jobs.get(sid) or {}
+            stats[sid] = {
+                "bytes": (self._event_bytes.get(sid, 0) + self._result_bytes.get(sid, 0)
+                          + sum(self._partial_bytes.get(sid, {}).values())),
+                "accessed": max(self._accessed.get(sid, 0), self._clients.get(sid, 0)),
+                "completed": self._completed.get(sid),
+                "job_state": job.get("state"),
+                "job_updated": job.get("updated", 0),
+            }
+        return stats
+
+    def drop_session(self, session_id: str, since: float = 0) -> bool:
+        for d in (self._events, self._results, self._partials, self._jobs, self._clients,
+                  self._event_bytes, self._result_bytes, self._partial_bytes,
+                  self._accessed, self._completed):
+            d.pop(session_id, None)
+        return True
+
+
+class SqliteStore(_StoreBase):
+    shared = True
+
+    def __init__(self, path: str, eviction: Optional[EvictionPolicy] = None):
+        super().__init__(eviction)
+        self.path = path
+        self._lock = threading.Lock()  # guards self._db
+        self._queue: "queue.Queue[Callable[[sqlite3.Connection], Any]]" = queue.Queue()
+        self._progress = threading.Condition()
+        self._submitted = 0  # writes queued so far
+        self._applied = 0    # writes committed so far
+        self.batches = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS events ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, kind TEXT, entry TEXT, created REAL);"
+            "CREATE INDEX IF NOT EXISTS events_session ON events(session_id, seq);"
+            "CREATE TABLE IF NOT EXISTS results (session_id TEXT PRIMARY KEY, value TEXT, updated REAL);"
+            "CREATE TABLE IF NOT EXISTS partials ("
+            " session_id TEXT, key TEXT, value TEXT, PRIMARY KEY (session_id, key));"
+            "CREATE TABLE IF NOT EXISTS jobs (session_id TEXT PRIMARY KEY, record TEXT, updated REAL);"
+            "CREATE TABLE IF NOT EXISTS clients (session_id TEXT PRIMARY KEY, seen REAL);"
+        )
+        self._db.commit()
+        self._writer = threading.Thread(target=self._write_loop, name="session-store-writer", daemon=True)
+        self._writer.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self._lock:
+                try:
+                    # BEGIN IMMEDIATE takes the write lock up front, so read-modify-
+                    # write ops (update_job) can't interleave with another process
+                    self._db.execute("BEGIN IMMEDIATE")
+                    for op in batch:
+                        try:
+                            op(self._db)
+                        except Exception as e:
+                            print(f"  [Session store] Write failed: {e}")
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    # e.g. another process held the lock past the timeout
+                    print(f"  [Session store] Dropped {len(batch)} writes: {e}")
+                    self._db.rollback()
+            self.batches += 1
+            with self._progress:
+                self._applied += len(batch)
+                self._progress.notify_all()
+
+    def _submit(self, op: Callable[[sqlite3.Connection], Any]) -> int:
+        """Queue a write; returns its ticket for _wait()."""
+        with self._progress:
+            self._submitted += 1
+            ticket = self._submitted
+            self._queue.put(op)  # under the condition so tickets match queue order
+        return ticket
+
+    def _wait(self, ticket: int) -> None:
+        with self._progress:
+            while self._applied < ticket:
+                self._progress.wait()
+
+    def _write(self, sql: str, params: tuple) -> None:
+        self._submit(lambda db: db.execute(sql, params))
+
+    def _call(self, op: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run `op` on the writer thread and wait for its result (blocking)."""
+        result: Dict[str, Any] = {}
+        self._wait(self._submit(lambda db: result.setdefault("value", op(db))))
+        return result.get("value")
+
+    def flush(self) -> None:
+        """Block until every write queued so far is committed."""
+        with self._progress:
+            ticket = self._submitted
+        self._wait(ticket)
+
+    def _read(self, sql: str, params: tuple) -> List[tuple]:
+        self.flush()
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    # -- event stream --
+    def append_event(self, session_id: str, kind: str, entry: Dict) -> Optional[int]:
+        # Queued, so the seq isn't known yet; readers get it from events_after()
+        self._write(
+            "INSERT INTO events (session_id, kind, entry, created) VALUES (?, ?, ?, ?)",
+            (session_id, kind, json.dumps(entry), time.time()),
+        )
+
+    def events_after(self, session_id: str, after: int = 0) -> List[Tuple[int, str, Dict]]:
+        rows = self._read(
+            "SELECT seq, kind, entry FROM events WHERE session_id = ? AND seq > ? ORDER BY seq",
+            (session_id, after),
+        )
+        return [(seq, kind, json.loads(entry)) for seq, kind, entry in rows]
+
+    def clear_events(self, session_id: str) -> None:
+        self._write("DELETE FROM events WHERE session_id = ?", (session_id,))
+
+    # -- results --
+    def set_result(self, session_id: str, value: Any) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO results (session_id, value, updated) VALUES (?, ?, ?)",
+            (session_id, json.dumps(value), time.time()),
+        )
+
+    def get_result(self, session_id: str) -> Optional[Any]:
+        rows = self._read("SELECT value FROM results WHERE session_id = ?", (session_id,))
+        return json.loads(rows[0][0]) if rows else self._read_spilled(session_id)
+
+    def delete_result(self, session_id: str) -> None:
+        def op(db: sqlite3.Connection) -> None:
+            db.execute("DELETE FROM results WHERE session_id = ?", (session_id,))
+            self._delete_spilled(session_id)
+        self._submit(op)
+
+    # -- partial plans --
+    def set_partial(self, session_id: str, key: str, task: Dict) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO partials (session_id, key, value) VALUES (?, ?, ?)",
+            (session_id, key, json.dumps(task)),
+        )
+
+    def get_partials(self, session_id: str) -> List[Dict]:
+        rows = self._read("SELECT value FROM partials WHERE session_id = ?", (session_id,))
+        return [json.loads(value) for (value,) in rows]
+
+    def clear_partials(self, session_id: str) -> None:
+        self._write("DELETE FROM partials WHERE session_id = ?", (session_id,))
+
+    # -- jobs --
+    def put_job(self, session_id: str, record: Dict) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO jobs (session_id, record, updated) VALUES (?, ?, ?)",
+            (session_id, json.dumps(record), time.time()),
+        )
+
+    def get_job(self, session_id: str) -> Optional[Dict]:
+        rows = self._read("SELECT record, updated FROM jobs WHERE session_id = ?", (session_id,))
+        if not rows:
+            return None
+        return dict(json.loads(rows[0][0]), updated=rows[0][1])
+
+    def update_job(self, session_id: str, run_id: str, **fields) -> None:
+        # Read-modify-write inside the writer's BEGIN IMMEDIATE transaction, so
+        # two workers can't interleave
+        def op(db: sqlite3.Connection) -> None:
+            row = db.execute("SELECT record FROM jobs WHERE session_id = ?", (session_id,)).fetchone()
+            if row is not None and json.loads(row[0]).get("run_id") == run_id:
+                record = dict(json.loads(row[0]), **fields)
+                db.execute(
+                    "UPDATE jobs SET record = ?, updated = ? WHERE session_id = ?",
+                    (json.dumps(record), time.time(), session_id),
+                )
+        self._submit(op)
+
+    # -- client heartbeats --
+    def touch_client(self, session_id: str) -> None:
+        self._write("INSERT OR REPLACE INTO clients (session_id, seen) VALUES (?, ?)", (session_id, time.time()))
+
+    def last_client_seen(self, session_id: str) -> Optional[float]:
+        rows = self._read("SELECT seen FROM clients WHERE session_id = ?", (session_id,))
+        return rows[0][0] if rows else None
+
+    # -- eviction --
+    def session_stats(self) -> Dict[str, Dict]:
+        stats: Dict[str, Dict] = {}
+
+        def entry(sid: str) -> Dict:
+            return stats.setdefault(sid, {"bytes": 0, "accessed": 0, "completed": None,
+                                          "job_state": None, "job_updated": 0})
+
+        for sid, size, last in self._read(
+                "SELECT session_id, SUM(LENGTH(entry)), MAX(created) FROM events GROUP BY session_id", ()):
+            e = entry(sid)
+            e["bytes"] += size or 0
+            e["accessed"] = max(e["accessed"], last or 0)
+        for sid, size, updated in self._read("SELECT session_id, LENGTH(value), updated FROM results", ()):
+            e = entry(sid)
+            e["bytes"] += size or 0
+            e["accessed"] = max(e["accessed"], updated)
+            e["completed"] = updated
+        for sid, size in self._read("SELECT session_id, SUM(LENGTH(value)) FROM partials GROUP BY session_id", ()):
+            entry(sid)["bytes"] += size or 0
+        for sid, record, updated in self._read("SELECT session_id, record, updated FROM jobs", ()):
+            e = entry(sid)
+            e["job_state"] = json.loads(record).get("state")
+            e["job_updated"] = updated
+            e["accessed"] = max(e["accessed"], updated)
+        for sid, seen in self._read("SELECT session_id, seen FROM clients", ()):
+            e = entry(sid)
+            e["accessed"] = max(e["accessed"], seen)
+        return stats
+
+    def drop_session(self, session_id: str, since: float = 0) -> bool:
+        """Delete everything for the session, unless its job record changed after `since`.
+
+        Blocks until the writer thread has done it; call it off the event loop.
+        """
+        def op(db: sqlite3.Connection) -> bool:
+            row = db.execute("SELECT updated FROM jobs WHERE session_id = ?", (session_id,)).fetchone()
+            if since and row and row[0] > since:
+                return False
+            for table in ("events", "results", "partials", "jobs", "clients"):
+                db.execute(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+            return True
+        return bool(self._call(op))
+
+    def metrics(self) -> Dict:
+        return dict(super().metrics(), write_batches=self.batches, write_queue=self._queue.qsize())
+
+
+def open_store(kind: str, path: str, eviction: Optional[EvictionPolicy] = None):
+    if kind == "sqlite":
+        return SqliteStore(path, eviction)
+    if kind == "memory":
+        return MemoryStore(eviction)
+    raise ValueError(f"Unknown SESSION_STORE '{kind}' (expected 'memory' or 'sqlite')")
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from PyPDF2 import PdfWriter
+
+import pdf_cache
+
+# Run with: python -m unittest test_pdf_cache  (from backend/)
+
+
+def _blank_pdf(path: str, pages: int) -> str:
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(100, 100)
+    writer.write(path)
+    return path
+
+
+class PageCacheEvictionTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        patches = [
+            mock.patch.object(pdf_cache, "PDF_CACHE_DIR", os.path.join(self.dir, "cache")),
+            mock.patch.object(pdf_cache, "PDF_CACHE_MEM_ENTRIES", 1),
+            mock.patch.object(pdf_cache, "_entries", pdf_cache.OrderedDict()),
+            mock.patch.object(pdf_cache, "_digests", {}),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.a = _blank_pdf(os.path.join(self.dir, "a.pdf"), 4)
+        self.b = _blank_pdf(os.path.join(self.dir, "b.pdf"), 3)
+
+    def test_pages_survive_eviction_during_extraction(self):
+        pdf_cache.get_page_count(self.a)  # entry for a in memory and on disk, no pages yet
+
+        def extract(path, indices, parallel=None):
+            # Meanwhile another thread evicts a and reloads it from disk as a new object
+            pdf_cache.get_page_count(self.b)
+            pdf_cache.get_page_count(self.a)
+            return 4, {i: f"text {i}" for i in indices}
+
+        with mock.patch.object(pdf_cache, "_extract_pages", side_effect=extract):
+            pages = pdf_cache.get_pages(self.a, [1, 2])
+        self.assertEqual(pages, {1: "text 1", 2: "text 2"})
+
+        # ...and they were persisted, not lost with the stale copy
+        pdf_cache._entries.clear()
+        with mock.patch.object(pdf_cache, "_extract_pages", side_effect=AssertionError("re-extracted")):
+            self.assertEqual(pdf_cache.get_pages(self.a, [1, 2]), {1: "text 1", 2: "text 2"})
+
+    def test_memory_is_bounded(self):
+        pdf_cache.get_pages(self.a, [0])
+        pdf_cache.get_pages(self.b, [0])
+        self.assertEqual(len(pdf_cache._entries), 1)
+        self.assertEqual(pdf_cache.get_pages(self.a, [0]), {0: ""})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import asyncio
+import unittest
+
+from pipeline import Degraded, Stage, StageGraph
+
+# Run with: python -m unittest test_pipeline  (from backend/)
+
+
+class StageGraphFailureTest(unittest.TestCase):
+    def test_failing_lazy_stage_fails_the_run(self):
+        async def syllabus():
+            raise RuntimeError("corrupt PDF")
+
+        async def topics(syllabus_info):
+            return await syllabus_info()
+
+        graph = StageGraph([
+            Stage("syllabus", syllabus, outputs=["syllabus_info"], lazy=True),
+            Stage("topics", topics, lazy_inputs=["syllabus_info"]),
+        ])
+
+        async def run():
+            return await asyncio.wait_for(graph.run({}), timeout=5)
+
+        with self.assertRaisesRegex(RuntimeError, "corrupt PDF"):
+            asyncio.run(run())
+
+    def test_failing_eager_stage_fails_consumers(self):
+        async def scope():
+            raise ValueError("no overview")
+
+        async def plan(scope):
+            return scope
+
+        graph = StageGraph([Stage("scope", scope), Stage("plan", plan, inputs=["scope"])])
+
+        async def run():
+            return await asyncio.wait_for(graph.run({}), timeout=5)
+
+        with self.assertRaisesRegex(ValueError, "no overview"):
+            asyncio.run(run())
+
+
+class MemoryCheckpoint:
+    def __init__(self):
+        self.saved = {}
+
+    def load(self, stage):
+        return self.saved.get(stage)
+
+    def save(self, stage, value):
+        self.saved[stage] = value
+
+
+class StageGraphCheckpointTest(unittest.TestCase):
+    def test_degraded_output_and_dependents_are_not_checkpointed(self):
+        async def scope():
+            return Degraded({"topics": []})
+
+        async def guide(scope):
+            return len(scope["topics"])
+
+        async def other():
+            return "fine"
+
+        graph = StageGraph([
+            Stage("scope", scope),
+            Stage("guide", guide, inputs=["scope"]),
+            Stage("other", other),
+        ])
+        checkpoint = MemoryCheckpoint()
+        values = asyncio.run(graph.run({}, checkpoint=checkpoint))
+
+        self.assertEqual(values["scope"], {"topics": []})
+        self.assertEqual(values["guide"], 0)
+        self.assertEqual(set(checkpoint.saved), {"other"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from datetime import date, timedelta
+
+from scheduler import REST_EVERY, schedule_locally, split_hour_budget, study_calendar
+
+# Run with: python -m unittest test_scheduler  (from backend/)
+
+START = date(2026, 10, 19)  # a Monday
+CONSTRAINTS = {"weekdayHours": 3, "weekendHours": 6, "noStudyDates": [], "reviewFrequency": "weekly"}
+
+
+def course(code: str, exam_date: str, n_topics: int = 3, hours: float = 2.0) -> dict:
+    return {
+        "code": code,
+        "exam_date": exam_date,
+        "topics": [{"topic": f"{code} topic {i}", "importance": "medium", "resource": "Ch 1", "hours": hours}
+                   for i in range(n_topics)],
+    }
+
+
+class DeadlineTest(unittest.TestCase):
+    def test_nothing_on_or_after_the_exam(self):
+        exam = START + timedelta(days=10)
+        plan = schedule_locally([course("MATH", exam.isoformat())], CONSTRAINTS, start=START)
+        self.assertTrue(plan["tasks"])
+        for t in plan["tasks"]:
+            self.assertLess(date.fromisoformat(t["date"]), exam)
+            self.assertGreaterEqual(date.fromisoformat(t["date"]), START)
+
+    def test_exam_on_or_before_start_schedules_nothing(self):
+        for exam in (START, START - timedelta(days=3)):
+            plan = schedule_locally([course("MATH", exam.isoformat()), course("BIO", "2026-11-20")],
+                                    CONSTRAINTS, start=START)
+            self.assertEqual({t["course"] for t in plan["tasks"]}, {"BIO"})
+            self.assertEqual(sorted(d["topic"] for d in plan["dropped"]),
+                             [f"MATH topic {i}" for i in range(3)])
+
+    def test_overflow_drops_topics_instead_of_passing_the_exam(self):
+        exam = START + timedelta(days=2)
+        plan = schedule_locally([course("MATH", exam.isoformat(), n_topics=10, hours=4)], CONSTRAINTS, start=START)
+        self.assertTrue(plan["dropped"])
+        self.assertTrue(all(date.fromisoformat(t["date"]) < exam for t in plan["tasks"]))
+
+    def test_split_hour_budget_skips_past_exams_and_stays_in_budget(self):
+        shards = split_hour_budget([course("MATH", START.isoformat())] +
+                                   [course(f"C{i}", "2026-11-20") for i in range(6)],
+                                   {"weekdayHours": 2, "weekendHours": 6}, start=START)
+        self.assertEqual(shards["MATH"]["weekdayHours"], 0)
+        self.assertEqual(shards["MATH"]["weekendHours"], 0)
+        self.assertLessEqual(sum(s["weekdayHours"] for s in shards.values()), 2)
+        self.assertLessEqual(sum(s["weekendHours"] for s in shards.values()), 6)
+
+
+class CalendarTest(unittest.TestCase):
+    def test_rest_day_after_every_streak(self):
+        days = study_calendar(START, START + timedelta(days=20), CONSTRAINTS)
+        streak = 0
+        d = START
+        while d < START + timedelta(days=20):
+            if d in days:
+                streak += 1
+                self.assertLessEqual(streak, REST_EVERY)
+            else:
+                self.assertEqual(streak, REST_EVERY)
+                streak = 0
+            d += timedelta(days=1)
+
+    def test_no_study_dates_are_skipped(self):
+        blocked = START + timedelta(days=1)
+        constraints = dict(CONSTRAINTS, noStudyDates=[blocked.isoformat()])
+        self.assertNotIn(blocked, study_calendar(START, START + timedelta(days=7), constraints))
+        plan = schedule_locally([course("MATH", "2026-11-20")], constraints, start=START)
+        self.assertNotIn(blocked.isoformat(), {t["date"] for t in plan["tasks"]})
+
+
+class TaskOrderTest(unittest.TestCase):
+    def test_learn_then_practice_then_review_on_later_days(self):
+        plan = schedule_locally([course("MATH", "2026-11-20", n_topics=4)], CONSTRAINTS, start=START)
+        by_topic = {}
+        for t in plan["tasks"]:
+            by_topic.setdefault(t["topic"], {}).setdefault(t["task_type"], []).append(date.fromisoformat(t["date"]))
+        self.assertEqual(len(by_topic), 4)
+        for topic, kinds in by_topic.items():
+            self.assertEqual(set(kinds), {"learn", "practice", "review"}, topic)
+            self.assertLess(max(kinds["learn"]), min(kinds["practice"]), topic)
+            self.assertLess(max(kinds["practice"]), min(kinds["review"]), topic)
+
+    def test_daily_budget_respected(self):
+        plan = schedule_locally([course("MATH", "2026-11-20", n_topics=6), course("BIO", "2026-11-10", n_topics=6)],
+                                CONSTRAINTS, start=START)
+        per_day = {}
+        for t in plan["tasks"]:
+            per_day[t["date"]] = per_day.get(t["date"], 0) + t["duration_hours"]
+        for day, hours in per_day.items():
+            limit = 6 if date.fromisoformat(day).weekday() >= 5 else 3
+            self.assertLessEqual(hours, limit, day)
+
+
+if __name__ == "__main__":
+    unittest.main()